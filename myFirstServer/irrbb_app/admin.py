@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Banco, Contrato, ResultadoBalance
+from .models import Banco, Contrato, Curva, Escenario, ResultadoBalance, ResultadoEscenario, Trabajo
 
 
 @admin.register(Banco)
@@ -9,6 +9,20 @@ class BancoAdmin(admin.ModelAdmin):
     search_fields = ("nombre",)
 
 
+@admin.register(Curva)
+class CurvaAdmin(admin.ModelAdmin):
+    list_display = ("nombre", "fecha")
+    list_filter = ("nombre",)
+    search_fields = ("nombre",)
+
+
+@admin.register(Escenario)
+class EscenarioAdmin(admin.ModelAdmin):
+    list_display = ("codigo", "nombre", "tipo", "activo", "created_at")
+    list_filter = ("tipo", "activo")
+    search_fields = ("codigo", "nombre")
+
+
 @admin.register(Contrato)
 class ContratoAdmin(admin.ModelAdmin):
     list_display = (
@@ -27,8 +41,15 @@ class ContratoAdmin(admin.ModelAdmin):
     search_fields = ("numero_contrato", "producto", "curva_asociada")
 
 
+class ResultadoEscenarioInline(admin.TabularInline):
+    model = ResultadoEscenario
+    extra = 0
+    readonly_fields = ("metrica", "escenario", "valor", "definicion")
+
+
 @admin.register(ResultadoBalance)
 class ResultadoBalanceAdmin(admin.ModelAdmin):
+    inlines = [ResultadoEscenarioInline]
     list_display = (
         "banco",
         "fecha_calculo",
@@ -44,3 +65,9 @@ class ResultadoBalanceAdmin(admin.ModelAdmin):
         "nii_parallel_down",
     )
     list_filter = ("banco", "fecha_calculo")
+
+
+@admin.register(Trabajo)
+class TrabajoAdmin(admin.ModelAdmin):
+    list_display = ("id", "banco", "tipo", "estado", "etapa", "progreso", "created_at", "started_at", "finished_at")
+    list_filter = ("estado", "tipo", "banco")
@@ -4,4 +4,10 @@ from users.models import CustomUser
 
 
 class UploadContractsForm(forms.Form):
-    excel_file = forms.FileField(label="Excel de contratos (.xlsx)")
\ No newline at end of file
+    MODOS = [
+        ("upsert", "Añadir nuevos y actualizar existentes"),
+        ("sync", "Sincronizar (además borra los contratos que no vienen en el fichero)"),
+    ]
+
+    excel_file = forms.FileField(label="Fichero de contratos (.xlsx, .csv, .parquet)")
+    modo = forms.ChoiceField(label="Modo de importación", choices=MODOS, initial="upsert", required=False)
\ No newline at end of file
@@ -0,0 +1,50 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from irrbb_app.services import jobs
+
+
+class Command(BaseCommand):
+    help = "Procesa la cola de trabajos de importación y valoración (sin broker externo)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Procesa los trabajos pendientes y termina")
+        parser.add_argument("--sleep", type=float, default=None, help="Segundos entre consultas a la cola")
+
+    def handle(self, *args, **options):
+        poll = options["sleep"] or getattr(settings, "IRRBB_JOB_POLL_SECONDS", 2)
+        stale_every = max(getattr(settings, "IRRBB_JOB_STALE_SECONDS", jobs.DEFAULT_STALE_SECONDS) / 10, poll)
+        name = jobs.worker_name()
+        self.stdout.write(f"Worker {name} esperando trabajos")
+
+        last_check = 0.0
+        while True:
+            close_old_connections()
+            if time.monotonic() - last_check > stale_every:
+                failed = jobs.fail_stale_jobs()
+                if failed:
+                    self.stderr.write(f"{failed} trabajos sin latido marcados como error")
+                last_check = time.monotonic()
+
+            trabajo = jobs.claim_next_job(name)
+            if trabajo is None:
+                if options["once"]:
+                    return
+                time.sleep(poll)
+                continue
+
+            self.stdout.write(f"Trabajo {trabajo.pk} ({trabajo.tipo}, banco {trabajo.banco_id}) en curso")
+            try:
+                jobs.run_job(trabajo)
+            except KeyboardInterrupt:
+                jobs.interrupt_job(trabajo)
+                self.stderr.write(f"Trabajo {trabajo.pk} interrumpido")
+                return
+
+            if trabajo.estado == trabajo.ERROR:
+                self.stderr.write(f"Trabajo {trabajo.pk}: {trabajo.error}")
+            else:
+                self.stdout.write(f"Trabajo {trabajo.pk}: {trabajo.estado} en {trabajo.tiempos.get('total')} s")
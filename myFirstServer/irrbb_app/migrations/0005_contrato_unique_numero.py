@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+# duplicados que se detallan como maximo en el error
+MAX_DUPLICATES_LISTED = 50
+
+
+def check_duplicate_contracts(apps, schema_editor):
+    # Las subidas repetidas podian duplicar contratos. La migracion no borra datos: si hay
+    # (banco, numero_contrato) repetidos se para con la lista para que se revisen a mano
+    # antes de crear la restriccion de unicidad.
+    Contrato = apps.get_model("irrbb_app", "Contrato")
+    duplicados = list(
+        Contrato.objects.values("banco_id", "numero_contrato")
+        .annotate(n=models.Count("id"))
+        .filter(n__gt=1)
+        .order_by("banco_id", "numero_contrato")
+    )
+    if not duplicados:
+        return
+    lineas = [
+        f"  banco {dup['banco_id']}, contrato {dup['numero_contrato']}: {dup['n']} filas (ids "
+        + ", ".join(str(pk) for pk in Contrato.objects.filter(
+            banco_id=dup["banco_id"], numero_contrato=dup["numero_contrato"]
+        ).order_by("id").values_list("id", flat=True))
+        + ")"
+        for dup in duplicados[:MAX_DUPLICATES_LISTED]
+    ]
+    if len(duplicados) > MAX_DUPLICATES_LISTED:
+        lineas.append(f"  ... y {len(duplicados) - MAX_DUPLICATES_LISTED} contratos repetidos más")
+    raise RuntimeError(
+        "Hay contratos repetidos por (banco, numero_contrato); elimine los sobrantes antes de migrar:\n"
+        + "\n".join(lineas)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irrbb_app", "0004_delete_curva"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_contracts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="contrato",
+            constraint=models.UniqueConstraint(
+                fields=("banco", "numero_contrato"), name="unique_contrato_por_banco"
+            ),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 6.0 on 2026-10-18 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irrbb_app", "0005_contrato_unique_numero"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContribucionContrato",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("numero_contrato", models.CharField(max_length=50)),
+                ("curve_version", models.CharField(max_length=40)),
+                ("producto", models.CharField(max_length=100)),
+                ("activo_pasivo", models.CharField(max_length=10)),
+                ("nominal", models.FloatField()),
+                ("valores", models.BinaryField()),
+                (
+                    "banco",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="contribuciones",
+                        to="irrbb_app.banco",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("banco", "curve_version", "numero_contrato"), name="unique_contribucion_por_version"
+                    )
+                ],
+            },
+        ),
+    ]
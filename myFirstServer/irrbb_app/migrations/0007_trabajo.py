@@ -0,0 +1,87 @@
+# Generated by Django 6.0 on 2026-10-18 21:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irrbb_app", "0006_contribucioncontrato"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Trabajo",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID"),
+                ),
+                (
+                    "tipo",
+                    models.CharField(
+                        choices=[("IMPORTAR", "Importar y valorar"), ("VALORAR", "Valorar")],
+                        default="IMPORTAR",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "estado",
+                    models.CharField(
+                        choices=[
+                            ("PENDIENTE", "Pendiente"),
+                            ("EN_CURSO", "En curso"),
+                            ("COMPLETADO", "Completado"),
+                            ("ERROR", "Error"),
+                        ],
+                        default="PENDIENTE",
+                        max_length=10,
+                    ),
+                ),
+                ("etapa", models.CharField(blank=True, max_length=30)),
+                ("progreso", models.FloatField(default=0)),
+                ("archivo", models.FileField(blank=True, upload_to="trabajos/")),
+                ("modo", models.CharField(default="upsert", max_length=10)),
+                ("informe", models.JSONField(blank=True, default=dict)),
+                ("error", models.TextField(blank=True)),
+                ("worker", models.CharField(blank=True, max_length=100)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                ("tiempos", models.JSONField(blank=True, default=dict)),
+                (
+                    "banco",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="trabajos",
+                        to="irrbb_app.banco",
+                    ),
+                ),
+                (
+                    "resultado",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="trabajos",
+                        to="irrbb_app.resultadobalance",
+                    ),
+                ),
+                (
+                    "uploaded_by",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="mis_trabajos",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [models.Index(fields=["estado", "created_at"], name="trabajo_estado_idx")],
+            },
+        ),
+    ]
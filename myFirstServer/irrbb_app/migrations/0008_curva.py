@@ -0,0 +1,37 @@
+# Generated by Django 6.0 on 2026-10-18 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irrbb_app", "0007_trabajo"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Curva",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("nombre", models.CharField(max_length=100)),
+                ("fecha", models.DateField()),
+                ("plazos", models.JSONField()),
+                ("tipos", models.JSONField()),
+                ("metadata", models.JSONField(blank=True, default=dict)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("nombre", "fecha"), name="unique_curva_por_fecha")
+                ],
+            },
+        ),
+    ]
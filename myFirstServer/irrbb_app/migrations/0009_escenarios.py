@@ -0,0 +1,94 @@
+# Generated by Django 6.0 on 2026-10-18 22:45
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irrbb_app", "0008_curva"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Escenario",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "codigo",
+                    models.CharField(
+                        max_length=50,
+                        unique=True,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                "^[a-z0-9_]+$", "Solo minusculas, numeros y _"
+                            )
+                        ],
+                    ),
+                ),
+                ("nombre", models.CharField(max_length=100)),
+                (
+                    "tipo",
+                    models.CharField(
+                        choices=[
+                            ("parallel", "Paralelo"),
+                            ("short", "Corto plazo"),
+                            ("long", "Largo plazo"),
+                            ("twist", "Giro"),
+                            ("key_rate", "Key rate"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("parametros", models.JSONField(blank=True, default=dict)),
+                ("activo", models.BooleanField(default=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ResultadoEscenario",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "metrica",
+                    models.CharField(choices=[("EVE", "EVE"), ("NII", "NII")], max_length=3),
+                ),
+                ("escenario", models.CharField(max_length=50)),
+                ("valor", models.FloatField()),
+                ("definicion", models.JSONField(blank=True, default=dict)),
+                (
+                    "resultado",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="escenarios",
+                        to="irrbb_app.resultadobalance",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("resultado", "metrica", "escenario"), name="unique_escenario_por_resultado"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 6.0 on 2026-10-18 23:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("irrbb_app", "0009_escenarios"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="cupon_spread",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="curva_asociada",
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="fecha_inicio",
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="fecha_vencimiento",
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="frecuencia_cupon",
+            field=models.IntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="tipo_amortizacion",
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name="contribucioncontrato",
+            name="tipo_interes",
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.CreateModel(
+            name="PerfilFlujos",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("curve_version", models.CharField(max_length=40)),
+                ("datos", models.BinaryField()),
+                (
+                    "banco",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="perfil_flujos",
+                        to="irrbb_app.banco",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -1,3 +1,5 @@
+from django.core.exceptions import ValidationError
+from django.core.validators import RegexValidator
 from django.db import models
 
 """
@@ -14,6 +16,24 @@ class Banco(models.Model):
         return self.nombre
 
 
+class Curva(models.Model):
+    # Curva de tipos por nombre (el de Contrato.curva_asociada) y fecha de referencia.
+    # plazos del tipo ["1M", "1Y", ...] y tipos en tanto por uno, en el mismo orden.
+    nombre = models.CharField(max_length=100)
+    fecha = models.DateField()
+    plazos = models.JSONField()
+    tipos = models.JSONField()
+    metadata = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["nombre", "fecha"], name="unique_curva_por_fecha"),
+        ]
+
+    def __str__(self):
+        return f"{self.nombre} ({self.fecha})"
+
+
 class Contrato(models.Model):
     ACTIVO = "ACTIVO"
     PASIVO = "PASIVO"
@@ -37,6 +57,11 @@ class Contrato(models.Model):
     frecuencia_cupon = models.IntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["banco", "numero_contrato"], name="unique_contrato_por_banco"),
+        ]
+
 
 class ResultadoBalance(models.Model):
     banco = models.ForeignKey(Banco, on_delete=models.CASCADE, related_name="resultados")
@@ -56,3 +81,124 @@ class ResultadoBalance(models.Model):
     nii_parallel_down = models.FloatField(default=0)
 
     metadata = models.JSONField(default=dict, blank=True)
+
+
+class Escenario(models.Model):
+    # Escenario de tipos definido por el usuario, ademas de los seis de la EBA. tipo y
+    # parametros se interpretan en services/scenarios.py (p.ej. "twist" con short_bp / long_bp).
+    PARALLEL = "parallel"
+    SHORT = "short"
+    LONG = "long"
+    TWIST = "twist"
+    KEY_RATE = "key_rate"
+    TIPOS = [(PARALLEL, "Paralelo"), (SHORT, "Corto plazo"), (LONG, "Largo plazo"), (TWIST, "Giro"), (KEY_RATE, "Key rate")]
+
+    # se usa en los nombres de columna y de metrica: rate_<codigo>_curve, eve_<codigo>, nii_<codigo>
+    codigo = models.CharField(
+        max_length=50, unique=True, validators=[RegexValidator(r"^[a-z0-9_]+$", "Solo minusculas, numeros y _")]
+    )
+    nombre = models.CharField(max_length=100)
+    tipo = models.CharField(max_length=10, choices=TIPOS)
+    parametros = models.JSONField(default=dict, blank=True)
+    activo = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.nombre
+
+    def clean(self):
+        from .services.scenarios import validate_scenario
+
+        try:
+            validate_scenario(self.codigo, self.tipo, self.parametros)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+
+class ResultadoEscenario(models.Model):
+    # valor de cada escenario (EBA y de usuario) de un ResultadoBalance, sin columnas fijas
+    EVE = "EVE"
+    NII = "NII"
+    METRICAS = [(EVE, "EVE"), (NII, "NII")]
+
+    resultado = models.ForeignKey(ResultadoBalance, on_delete=models.CASCADE, related_name="escenarios")
+    metrica = models.CharField(max_length=3, choices=METRICAS)
+    escenario = models.CharField(max_length=50)
+    valor = models.FloatField()
+    definicion = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["resultado", "metrica", "escenario"], name="unique_escenario_por_resultado"),
+        ]
+
+
+class ContribucionContrato(models.Model):
+    # EVE/NII de cada contrato en cada escenario para una version de curva (valores float64
+    # en el orden de ScenarioSet.eve + ScenarioSet.nii). Sin FK a Contrato para poder restar
+    # los contratos borrados al recalcular solo lo que cambia; guarda tambien las condiciones
+    # con que se valoro para regenerar sus flujos (PerfilFlujos).
+    banco = models.ForeignKey(Banco, on_delete=models.CASCADE, related_name="contribuciones")
+    numero_contrato = models.CharField(max_length=50)
+    curve_version = models.CharField(max_length=40)
+    producto = models.CharField(max_length=100)
+    activo_pasivo = models.CharField(max_length=10)
+    nominal = models.FloatField()
+    fecha_inicio = models.DateField(null=True)
+    fecha_vencimiento = models.DateField(null=True)
+    tipo_interes = models.CharField(max_length=10, blank=True)
+    tipo_amortizacion = models.CharField(max_length=10, blank=True)
+    cupon_spread = models.FloatField(default=0)
+    frecuencia_cupon = models.IntegerField(default=1)
+    curva_asociada = models.CharField(max_length=100, blank=True)
+    valores = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["banco", "curve_version", "numero_contrato"], name="unique_contribucion_por_version"
+            ),
+        ]
+
+
+class PerfilFlujos(models.Model):
+    # Flujos de toda la cartera del banco agregados por dia y curva en la ultima valoracion
+    # (CashflowProfile.to_bytes). El recalculo incremental lo actualiza igual que el desglose.
+    banco = models.OneToOneField(Banco, on_delete=models.CASCADE, related_name="perfil_flujos")
+    curve_version = models.CharField(max_length=40)
+    datos = models.BinaryField()
+
+
+class Trabajo(models.Model):
+    # Importacion y/o valoracion que se ejecuta fuera de la peticion web (manage.py irrbb_worker)
+    IMPORTAR = "IMPORTAR"
+    VALORAR = "VALORAR"
+    TIPOS = [(IMPORTAR, "Importar y valorar"), (VALORAR, "Valorar")]
+
+    PENDIENTE = "PENDIENTE"
+    EN_CURSO = "EN_CURSO"
+    COMPLETADO = "COMPLETADO"
+    ERROR = "ERROR"
+    ESTADOS = [(PENDIENTE, "Pendiente"), (EN_CURSO, "En curso"), (COMPLETADO, "Completado"), (ERROR, "Error")]
+
+    banco = models.ForeignKey(Banco, on_delete=models.CASCADE, related_name="trabajos")
+    uploaded_by = models.ForeignKey('users.CustomUser', related_name="mis_trabajos", on_delete=models.SET_NULL, null=True)
+    tipo = models.CharField(max_length=10, choices=TIPOS, default=IMPORTAR)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default=PENDIENTE)
+    etapa = models.CharField(max_length=30, blank=True)
+    progreso = models.FloatField(default=0)
+
+    archivo = models.FileField(upload_to="trabajos/", blank=True)
+    modo = models.CharField(max_length=10, default="upsert")
+    informe = models.JSONField(default=dict, blank=True)
+    error = models.TextField(blank=True)
+    resultado = models.ForeignKey(ResultadoBalance, on_delete=models.SET_NULL, null=True, blank=True, related_name="trabajos")
+
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    tiempos = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["estado", "created_at"], name="trabajo_estado_idx")]
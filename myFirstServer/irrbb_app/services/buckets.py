@@ -0,0 +1,112 @@
+import numpy as np
+
+from .curve import cashflow_days, curve_grid
+from .eve_calculation import KEY_RATE_TENORS
+from .eve_calculation import SCENARIO_COLUMNS as EVE_SCENARIOS
+from .nii_calculation import SCENARIO_COLUMNS as NII_SCENARIOS
+from .nii_calculation import repricing_notional
+from .utils import tenors_to_years
+
+# Bandas temporales de repreciacion del marco estandar de IRRBB (EBA / Basilea): etiqueta,
+# limite superior y punto medio en años. Cada flujo cae en la banda cuyo limite superior
+# es el primero >= su plazo, asi que el horizonte de 1 año del NII coincide con un limite.
+EBA_BUCKETS = (
+    ("O/N", 1 / 360, 0.0028),
+    ("O/N-1M", 1 / 12, 0.0417),
+    ("1M-3M", 0.25, 0.1667),
+    ("3M-6M", 0.5, 0.375),
+    ("6M-9M", 0.75, 0.625),
+    ("9M-1Y", 1.0, 0.875),
+    ("1Y-1.5Y", 1.5, 1.25),
+    ("1.5Y-2Y", 2.0, 1.75),
+    ("2Y-3Y", 3.0, 2.5),
+    ("3Y-4Y", 4.0, 3.5),
+    ("4Y-5Y", 5.0, 4.5),
+    ("5Y-6Y", 6.0, 5.5),
+    ("6Y-7Y", 7.0, 6.5),
+    ("7Y-8Y", 8.0, 7.5),
+    ("8Y-9Y", 9.0, 8.5),
+    ("9Y-10Y", 10.0, 9.5),
+    ("10Y-15Y", 15.0, 12.5),
+    ("15Y-20Y", 20.0, 17.5),
+    (">20Y", np.inf, 25.0),
+)
+
+BUCKET_LABELS = tuple(label for label, _, _ in EBA_BUCKETS)
+N_BUCKETS = len(EBA_BUCKETS)
+# limites y puntos medios en dias (t = dia / 360, como la tabla diaria de la curva)
+BUCKET_UPPER_DAYS = np.array([upper * 360 for _, upper, _ in EBA_BUCKETS])
+BUCKET_MIDPOINT_DAYS = np.rint([midpoint * 360 for _, _, midpoint in EBA_BUCKETS]).astype(np.int64)
+
+# columnas de la tabla de gaps por grupo: cada campo ocupa N_BUCKETS columnas seguidas
+GAP_FIELDS = ("cashflow", "repricing_notional")
+
+
+def bucket_of_days(days):
+    # banda de cada dia: se busca una vez por dia distinto y se indexa
+    days = np.asarray(days, dtype=np.int64)
+    if len(days) == 0:
+        return days
+    return np.searchsorted(BUCKET_UPPER_DAYS, np.arange(int(days.max()) + 1), side="left")[days]
+
+
+def bucket_totals(values, buckets, groups, n_groups):
+    # suma por (grupo, banda) -> matriz grupos x bandas en una sola reduccion
+    return np.bincount(groups * N_BUCKETS + buckets, weights=values, minlength=n_groups * N_BUCKETS).reshape(n_groups, N_BUCKETS)
+
+
+def gap_by_group(cashflows, groups, n_groups):
+    # flujos y saldo que se reprecia por (grupo, banda): matriz grupos x (campos * bandas)
+    groups = np.asarray(groups, dtype=np.int64)
+    buckets = bucket_of_days(cashflow_days(cashflows))
+    values = {
+        "cashflow": np.asarray(cashflows["cashflow"], dtype=np.float64),
+        "repricing_notional": repricing_notional(cashflows),
+    }
+    return np.hstack([bucket_totals(values[field], buckets, groups, n_groups) for field in GAP_FIELDS])
+
+
+def split_gap(row):
+    # fila de la tabla de gaps -> {campo: [valor por banda]}
+    row = np.asarray(row, dtype=np.float64)
+    return {field: row[i * N_BUCKETS:(i + 1) * N_BUCKETS].tolist() for i, field in enumerate(GAP_FIELDS)}
+
+
+def join_gap(gap):
+    # inversa de split_gap
+    return np.concatenate([np.asarray(gap.get(field, [0.0] * N_BUCKETS), dtype=np.float64) for field in GAP_FIELDS])
+
+
+# Modo por bandas: los flujos de cada (grupo, banda) se agregan y se valoran en el punto
+# medio de la banda, asi que se descuentan grupos x 19 importes en vez de grupos x dias.
+
+def _midpoint_table(curve_df, table, *args):
+    grid = curve_grid(curve_df)
+    return getattr(grid, table)(*args, int(BUCKET_MIDPOINT_DAYS.max()))[BUCKET_MIDPOINT_DAYS]
+
+
+def calculate_eve_krd_bucketed(cashflows_df, curve_df, groups, n_groups, scenario_columns = None, key_rate_tenors = KEY_RATE_TENORS):
+    # como calculate_eve_krd_by_group, descontando cada flujo en el punto medio de su banda
+    if scenario_columns is None:
+        scenario_columns = EVE_SCENARIOS
+    groups = np.asarray(groups, dtype=np.int64)
+    buckets = bucket_of_days(cashflow_days(cashflows_df))
+    totals = bucket_totals(np.asarray(cashflows_df["cashflow"], dtype=np.float64), buckets, groups, n_groups)
+    eve = totals @ _midpoint_table(curve_df, "discount_factors", list(scenario_columns.values()))
+    krd = totals @ _midpoint_table(curve_df, "key_rate_table", tenors_to_years(key_rate_tenors))
+    return eve, krd
+
+
+def calculate_nii_bucketed(cashflows_df, curve_df, groups, n_groups, horizon_years = 1.0, scenario_columns = None):
+    # como calculate_nii_by_group: los intereses del horizonte son exactos y el saldo que se
+    # reprecia se desplaza con el cambio de tipo en el punto medio de su banda
+    if scenario_columns is None:
+        scenario_columns = NII_SCENARIOS
+    in_horizon = np.asarray(cashflows_df["year"], dtype=np.float64) <= horizon_years
+    groups = np.asarray(groups, dtype=np.int64)[in_horizon]
+    interest = np.bincount(groups, weights=np.asarray(cashflows_df["interest"], dtype=np.float64)[in_horizon], minlength=n_groups)
+
+    buckets = bucket_of_days(cashflow_days(cashflows_df)[in_horizon])
+    totals = bucket_totals(repricing_notional(cashflows_df)[in_horizon], buckets, groups, n_groups)
+    rates = _midpoint_table(curve_df, "rate_table", ["rate_base_curve", *scenario_columns.values()])
+    return interest[:, None] + totals @ (rates[:, 1:] - rates[:, :1])
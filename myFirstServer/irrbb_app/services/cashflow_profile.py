@@ -0,0 +1,61 @@
+import io
+
+import numpy as np
+
+from .curve import cashflow_days
+from .nii_calculation import repricing_notional
+
+# Flujos de toda la cartera agregados por dia (desde la fecha de valoracion), una tabla
+# por curva. Las metricas que solo dependen de la suma de flujos de cada dia (barridos de
+# shocks, simulaciones...) se calculan sobre esta tabla en vez de sobre los flujos.
+
+PROFILE_FIELDS = ("cashflow", "interest", "repricing_notional")
+
+
+def day_profile(cashflows):
+    # tabla columnar de flujos -> matriz campos x dias
+    days = cashflow_days(cashflows)
+    if len(days) == 0:
+        return np.zeros((len(PROFILE_FIELDS), 0))
+    width = int(days.max()) + 1
+    values = {
+        "cashflow": np.asarray(cashflows["cashflow"], dtype=np.float64),
+        "interest": np.asarray(cashflows["interest"], dtype=np.float64),
+        "repricing_notional": repricing_notional(cashflows),
+    }
+    return np.vstack([np.bincount(days, weights=values[field], minlength=width) for field in PROFILE_FIELDS])
+
+
+class CashflowProfile:
+    # tables: {curve_key: matriz campos x dias}
+    def __init__(self, tables=None):
+        self.tables = dict(tables or {})
+
+    def add(self, parts, sign=1):
+        # parts: {curve_key: matriz campos x dias} de un trozo de cartera
+        for key, table in parts.items():
+            current = self.tables.get(key)
+            if current is None:
+                current = np.zeros((len(PROFILE_FIELDS), 0))
+            width = max(current.shape[1], table.shape[1])
+            if current.shape[1] < width:
+                current = np.pad(current, ((0, 0), (0, width - current.shape[1])))
+            current[:, : table.shape[1]] += sign * table
+            self.tables[key] = current
+
+    def table(self, key):
+        # la tabla de una curva con el formato de los flujos (day, year, cashflow, ...):
+        # se puede pasar tal cual a calculate_eve / calculate_nii
+        values = self.tables[key]
+        days = np.arange(values.shape[1])
+        return {"day": days, "year": days / 360, **dict(zip(PROFILE_FIELDS, values))}
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **self.tables)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        with np.load(io.BytesIO(bytes(data)), allow_pickle=False) as stored:
+            return cls({key: stored[key] for key in stored.files})
@@ -1,22 +1,126 @@
 from datetime import date
+from bisect import bisect_right
+from functools import lru_cache
+
+import numpy as np
 import pandas as pd
-from .utils import interpolate_rate, year_fraction_30_360
+from .portfolio import AMORT_ALEMANA, AMORT_FRANCESA
+from .utils import date_parts, days_in_month, interpolate_rate, year_fraction_30_360, year_fractions
 
-def generate_payment_dates(fecha_inicio: date, fecha_vencimiento: date, frecuencia_cupon: int):
-    if frecuencia_cupon <= 0:
-        frecuencia_cupon = 1
+SCHEDULE_CACHE_SIZE = 4096
+DRIFT_LOOKBACK = 48
+
+
+def _segmented_cummin(values, segment):
+    # minimo acumulado que se reinicia en cada contrato (values entre 28 y 31)
+    offset = (segment.max() + 1 - segment) * 64 if len(segment) else 0
+    return np.minimum.accumulate(values + offset) - offset
+
+
+def _months_per_period(frecuencia_cupon):
+    freq = np.where(frecuencia_cupon <= 0, 1, frecuencia_cupon)
+    return np.maximum(12 // freq, 1)
+
+
+def _drift_day(inicio_m, dia_inicio, step, k):
+    # dia de la fecha k-esima sin generar las anteriores: min(dia inicial, dias de los meses
+    # visitados). Con step <= 12 los primeros 48 periodos ya recorren todos los meses y un
+    # febrero no bisiesto, asi que basta con mirar esa ventana.
+    dia = dia_inicio.copy()
+    sub = (dia_inicio > 28) & (k > 0)
+    if sub.any():
+        j = np.arange(1, DRIFT_LOOKBACK + 1)
+        meses = inicio_m[sub, None] + j[None, :] * step[sub, None]
+        dims = np.where(j[None, :] <= k[sub, None], days_in_month(meses), 31)
+        dia[sub] = np.minimum(dia_inicio[sub], dims.min(axis=1))
+    return dia
+
+
+def _payment_schedule(inicio, fin, step, valuation=None):
+    # Calendarios de pago de varios contratos a la vez con aritmetica datetime64[M].
+    # Devuelve (idx, k, fechas, inicios, n_periods): contrato, numero de periodo (1..n),
+    # fecha de pago e inicio de periodo de cada fila. Con valuation solo se generan los
+    # periodos que terminan despues de esa fecha.
+    inicio_m = inicio.astype("datetime64[M]")
+    _, _, dia_inicio = date_parts(inicio)
+    _, _, dia_fin = date_parts(fin)
+
+    # numero de periodos: ceil(meses / step), uno mas si en el mes del vencimiento
+    # la fecha calculada queda antes del dia de vencimiento (tramo final)
+    meses_hasta_fin = (fin.astype("datetime64[M]") - inicio_m).astype(np.int64)
+    kc = -(-meses_hasta_fin // step)
+    exacto = (meses_hasta_fin % step == 0) & (kc >= 1)
+    dia_kc = _drift_day(inicio_m, dia_inicio, step, np.maximum(kc, 0))
+    n_periods = np.maximum(kc, 1) + (exacto & (dia_kc < dia_fin))
+    n_periods = np.where(inicio < fin, n_periods, 0)
 
-    meses_por_periodo = int(12 / frecuencia_cupon)
-    fechas = []
-    actual = pd.to_datetime(fecha_inicio)
-    fin = pd.to_datetime(fecha_vencimiento)
+    if valuation is None:
+        k_first = np.ones_like(n_periods)
+    else:
+        # primer periodo cuya fecha de pago es posterior a la fecha de valoracion
+        _, _, dia_val = date_parts(np.array([valuation]))
+        meses_hasta_val = (valuation.astype("datetime64[M]") - inicio_m).astype(np.int64)
+        q = meses_hasta_val // step
+        dia_q = _drift_day(inicio_m, dia_inicio, step, np.maximum(q, 0))
+        en_mes = (q >= 1) & (meses_hasta_val % step == 0) & (dia_q > dia_val)
+        k_first = np.maximum(np.where(en_mes, q, q + 1), 1)
+        k_first = np.where(fin <= valuation, n_periods + 1, np.minimum(k_first, n_periods + 1))
+
+    counts = n_periods - k_first + 1
+    idx = np.repeat(np.arange(len(inicio)), counts)
+    first_row = np.cumsum(counts) - counts
+    k = np.arange(len(idx)) - first_row[idx] + k_first[idx]
+
+    # DateOffset(months=...) se aplica sobre la fecha anterior: el dia solo puede bajar
+    # (31 ene -> 28 feb -> 28 mar), es el minimo acumulado de los dias de cada mes
+    dia_previo = _drift_day(inicio_m, dia_inicio, step, k_first - 1)
+    mes_k = inicio_m[idx] + k * step[idx]
+    dia_k = np.minimum(dia_previo[idx], _segmented_cummin(days_in_month(mes_k), idx))
+    fechas = np.minimum(mes_k.astype("datetime64[D]") + (dia_k - 1), fin[idx])
+
+    inicios = np.empty_like(fechas)
+    if len(fechas):
+        inicios[1:] = fechas[:-1]
+    primeras = first_row[counts > 0]
+    c = idx[primeras]
+    inicios[primeras] = (inicio_m[c] + (k_first[c] - 1) * step[c]).astype("datetime64[D]") + (dia_previo[c] - 1)
+    return idx, k, fechas, inicios, n_periods
+
+
+def _unique_schedules(inicio, fin, step, valuation=None):
+    # calcula cada terna (inicio, vencimiento, step) distinta una sola vez y la reparte
+    keys = np.stack([inicio.astype(np.int64), fin.astype(np.int64), step.astype(np.int64)], axis=1)
+    uniq, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    idx_u, k_u, fechas_u, inicios_u, n_periods_u = _payment_schedule(
+        uniq[:, 0].astype("datetime64[D]"), uniq[:, 1].astype("datetime64[D]"), uniq[:, 2], valuation
+    )
+    counts_u = np.bincount(idx_u, minlength=len(uniq))
+    first_row_u = np.cumsum(counts_u) - counts_u
 
-    while actual < fin:
-        actual = actual + pd.DateOffset(months=meses_por_periodo)
-        if actual > fin:
-            actual = fin
-        fechas.append(actual)
-    return fechas
+    counts = counts_u[inverse]
+    idx = np.repeat(np.arange(len(inicio)), counts)
+    first_row = np.cumsum(counts) - counts
+    pos = first_row_u[inverse[idx]] + np.arange(len(idx)) - first_row[idx]
+    return idx, k_u[pos], fechas_u[pos], inicios_u[pos], n_periods_u[inverse]
+
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def _cached_payment_dates(fecha_inicio, fecha_vencimiento, meses_por_periodo):
+    _, _, fechas, _, _ = _payment_schedule(
+        np.array([fecha_inicio], dtype="datetime64[D]"),
+        np.array([fecha_vencimiento], dtype="datetime64[D]"),
+        np.array([meses_por_periodo]),
+    )
+    return tuple(fechas.tolist())
+
+
+def generate_payment_dates(fecha_inicio: date, fecha_vencimiento: date, frecuencia_cupon: int):
+    # tupla de fechas (date) compartida entre contratos con los mismos terminos: no modificar
+    meses_por_periodo = int(_months_per_period(frecuencia_cupon))
+    return _cached_payment_dates(
+        np.datetime64(fecha_inicio, "D").item(), np.datetime64(fecha_vencimiento, "D").item(), meses_por_periodo
+    )
 
 def effective_rate(contract, curve_df):
     if contract.tipo_interes == contract.FIJO:
@@ -31,7 +135,7 @@ def effective_rate(contract, curve_df):
     return base_rate + float(contract.cupon_spread)
 
 
-def build_cashflows(contract, curve_df, valuation_date = None):
+def build_cashflows(contract, curve_df, valuation_date = None, forward_only = False):
     if valuation_date is None:
         valuation_date = date.today()
 
@@ -64,13 +168,27 @@ def build_cashflows(contract, curve_df, valuation_date = None):
         cuota = None
         amort_per_period = 0
 
-    last_date = pd.to_datetime(contract.fecha_inicio)
+    last_date = np.datetime64(contract.fecha_inicio, "D").item()
+
+    first = 0
+    if forward_only: #salto directamente al primer periodo que termina despues de valuation_date
+        first = bisect_right(payment_dates, valuation_date)
+        if first == n_periods:
+            return pd.DataFrame()
+        if first > 0:
+            last_date = payment_dates[first - 1]
+            if contract.tipo_amortizacion == contract.FRANCESA: #saldo vivo tras `first` cuotas
+                growth = (1 + period_rate) ** first
+                nom_rest = nom_rest * growth - cuota * (growth - 1) / period_rate
+            elif contract.tipo_amortizacion == contract.ALEMANA:
+                nom_rest = nom_rest - amort_per_period * first
+            nom_rest = max(nom_rest, 0)
     
     #recorro fechas de pago y genero flujos
-    for i, pay_date in enumerate(payment_dates, start=1): 
-        year_frac = year_fraction_30_360(last_date.date(), pay_date.date())
+    for i, pay_date in enumerate(payment_dates[first:], start=first + 1): 
+        year_frac = year_fraction_30_360(last_date, pay_date)
 
-        dias = (pay_date.date() - valuation_date).days
+        dias = (pay_date - valuation_date).days
         if dias < 0:
             t = 0
         else:
@@ -96,9 +214,9 @@ def build_cashflows(contract, curve_df, valuation_date = None):
         rows.append(
             {
                 "contract_id": contract.id,
-                "payment_date": pay_date.date(),
-                "period_start": last_date.date(),
-                "period_end": pay_date.date(),
+                "payment_date": pay_date,
+                "period_start": last_date,
+                "period_end": pay_date,
                 "year_fraction": year_frac,
                 "year": t,
                 "rest_start": nom_rest * sign,
@@ -114,4 +232,100 @@ def build_cashflows(contract, curve_df, valuation_date = None):
         nom_rest = nom_rest_after
         last_date = pay_date
 
-    return pd.DataFrame(rows)
\ No newline at end of file
+    return pd.DataFrame(rows)
+
+# ---------------------------------------------------------------------------
+# Motor vectorizado a nivel cartera: todos los contratos de un banco a la vez
+# ---------------------------------------------------------------------------
+
+def _effective_rates(portfolio, curve_df):
+    rates = portfolio["cupon_spread"].copy()
+    floating = portfolio["is_floating"]
+    if floating.any():
+        n_years = year_fractions(portfolio["fecha_inicio"][floating], portfolio["fecha_vencimiento"][floating], "ACT/365")
+        n_years = np.where(n_years <= 0, 0.01, n_years)
+        base_rate_bp = np.interp(n_years, curve_df["maturity_years"].to_numpy(), curve_df["rate_base_curve"].to_numpy())
+        rates[floating] += base_rate_bp / 10000
+    return rates
+
+
+def build_portfolio_cashflows(portfolio, curve_df, valuation_date=None, forward_only=False):
+    # Equivalente a build_cashflows para todos los contratos de golpe.
+    # Devuelve un dict de arrays planos (una posicion por flujo); "contract_index"
+    # apunta a la posicion del contrato dentro de portfolio. Con forward_only solo se
+    # generan los periodos que terminan despues de valuation_date.
+    if valuation_date is None:
+        valuation_date = date.today()
+    valuation = np.datetime64(valuation_date, "D")
+
+    inicio = portfolio["fecha_inicio"]
+    fin = portfolio["fecha_vencimiento"]
+
+    freq = np.where(portfolio["frecuencia_cupon"] <= 0, 1, portfolio["frecuencia_cupon"])
+    step = _months_per_period(portfolio["frecuencia_cupon"])
+
+    idx, k, payment_date, period_start, n_periods = _unique_schedules(
+        inicio, fin, step, valuation if forward_only else None
+    )
+
+    year_frac = year_fractions(period_start, payment_date, "30/360")
+    day = np.maximum((payment_date - valuation).astype(np.int64), 0)
+    year = day / 360
+
+    # tasa por periodo y saldo vivo al inicio de cada periodo (formulas cerradas)
+    period_rate_c = _effective_rates(portfolio, curve_df) / freq
+    nominal = portfolio["nominal"]
+    amort = portfolio["amortizacion"]
+    n_c = np.maximum(n_periods, 1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cuota_c = np.where(
+            period_rate_c != 0,
+            nominal * period_rate_c / (1 - np.power(1 + period_rate_c, -n_c)),
+            nominal / n_c,
+        )
+
+    r = period_rate_c[idx]
+    N = nominal[idx]
+    j = k - 1
+    a = amort[idx]
+
+    growth = np.power(1 + r, j)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        saldo_francesa = np.where(r != 0, N * growth - cuota_c[idx] * (growth - 1) / r, N - cuota_c[idx] * j)
+    saldo_alemana = N - j * (N / n_c[idx])
+
+    rest = np.select([a == AMORT_FRANCESA, a == AMORT_ALEMANA], [saldo_francesa, saldo_alemana], N)
+    rest = np.maximum(rest, 0)
+    interest = rest * r
+    principal = np.select(
+        [a == AMORT_FRANCESA, a == AMORT_ALEMANA],
+        [cuota_c[idx] - interest, N / n_c[idx]],
+        np.where(k == n_periods[idx], rest, 0),
+    )
+
+    sign = np.where(portfolio["activo_pasivo"] == "ACTIVO", 1.0, -1.0)[idx]
+
+    return {
+        "contract_index": idx,
+        "contract_id": portfolio["id"][idx],
+        "payment_date": payment_date,
+        "period_start": period_start,
+        "period_end": payment_date,
+        "year_fraction": year_frac,
+        "year": year,
+        "day": day,
+        "rest_start": rest * sign,
+        "interest": interest * sign,
+        "principal": principal * sign,
+        "cashflow": (interest + principal) * sign,
+        "rate_per_period": r,
+        "is_floating": portfolio["is_floating"][idx].astype(np.int64),
+    }
+
+
+def cashflows_frame(cashflows, rows=None):
+    # tabla columnar -> DataFrame (opcionalmente solo algunas filas)
+    if rows is None:
+        return pd.DataFrame(cashflows)
+    return pd.DataFrame({col: values[rows] for col, values in cashflows.items()})
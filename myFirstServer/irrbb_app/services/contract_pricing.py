@@ -1,65 +1,145 @@
 from __future__ import annotations
+import time
 from datetime import date
-import pandas as pd
+from django.conf import settings
 from django.db import transaction
 
-from ..models import Banco, ResultadoBalance
-from .cashflows import build_cashflows
-from .curve import build_default_curve
-from .eve_calculation import calculate_eve
-from .nii_calculation import calculate_nii
+import numpy as np
 
-def _process_contracts(banco, curve_df):
-    activos = {}
-    pasivos = {}
-    activos_cashflows = {}
-    pasivos_cashflows = {}
+from ..models import Banco, PerfilFlujos, ResultadoBalance, ResultadoEscenario
+from . import contributions
+from .cashflow_profile import CashflowProfile
+from .curve_registry import curves_for_bank, load_scenario_set
+from .pooling import DEFAULT_MATURITY_MONTHS, DEFAULT_RATE_BAND_BP, pool_portfolio
+from .portfolio import iter_portfolio, load_portfolio, portfolio_size
+from .eve_calculation import KEY_RATE_TENORS
+from .nii_projection import DEFAULT_HORIZONS, project_nii
+from .portfolio_pricing import DEFAULT_CHUNK_SIZE, PortfolioAccumulator, iter_chunks, price_contracts, price_portfolio
+from .shock_sweep import DEFAULT_SWEEP_RANGE, SWEEP_SHAPES, shock_sweep, sweep_shocks
+from .simulation import DEFAULT_MODEL, DEFAULT_QUANTILES, simulate_profile
 
-    valuation_date = date.today()
-    contratos = banco.contratos.all()
+def _bucketed():
+    return getattr(settings, "IRRBB_BUCKETED_CASHFLOWS", False)
 
-    for contrato in contratos:
-        cf = build_cashflows(contrato, curve_df, valuation_date)
-        
-        if contrato.activo_pasivo == "ACTIVO":
-            _act_dict(contrato.producto, contrato, cf, activos, activos_cashflows)
-        else:
-            _act_dict(contrato.producto, contrato, cf, pasivos, pasivos_cashflows)
-    
-    _calculate_eve_nii(activos, activos_cashflows, curve_df)
-    _calculate_eve_nii(pasivos, pasivos_cashflows, curve_df)
-    
-    return activos, pasivos
-
-def _act_dict(producto, contrato, cf, dict_obj, dict_cf):
-    if producto not in dict_obj:
-        dict_obj[producto] = {"count": 0, "nominal": 0}
-        dict_cf[producto] = []
-    dict_obj[producto]["count"] += 1
-    dict_obj[producto]["nominal"] += contrato.nominal
-    if not cf.empty:
-        dict_cf[producto].append(cf)
-
-def _calculate_eve_nii(productos_dict, cashflows_dict, curve_df):
-    for producto in productos_dict:
-        if cashflows_dict[producto]:
-            cf_grupo = pd.concat(cashflows_dict[producto], ignore_index=True)
-            eve_res = calculate_eve(cf_grupo, curve_df)
-            nii_res = calculate_nii(cf_grupo, curve_df)
-
-            scenario = {}
-            for key, val in eve_res.items():
-                scenario[key] = val
-            for key, val in nii_res.items():
-                scenario[key] = val
-
-            productos_dict[producto]["scenario"] = scenario
-        else:
-            productos_dict[producto]["scenario"] = {
-                "eve_base": 0, "eve_parallel_up": 0, "eve_parallel_down": 0,
-                "eve_steepener": 0, "eve_flattener": 0, "eve_short_up": 0, "eve_short_down": 0,
-                "nii_base": 0, "nii_parallel_up": 0, "nii_parallel_down": 0
-            }
+def _key_rate_tenors():
+    return tuple(getattr(settings, "IRRBB_KEY_RATE_TENORS", KEY_RATE_TENORS))
+
+def _pooling():
+    # granularidad de los pools (IRRBB_POOLING) o None para valorar contrato a contrato
+    if not getattr(settings, "IRRBB_POOLING", False):
+        return None
+    return {
+        "maturity_months": getattr(settings, "IRRBB_POOLING_MATURITY_MONTHS", DEFAULT_MATURITY_MONTHS),
+        "rate_band_bp": getattr(settings, "IRRBB_POOLING_RATE_BAND_BP", DEFAULT_RATE_BAND_BP),
+        "start_months": getattr(settings, "IRRBB_POOLING_START_MONTHS", None),
+    }
+
+def _pricing_options(workers, chunk_size):
+    if workers is None:
+        workers = getattr(settings, "IRRBB_PRICING_WORKERS", 1)
+    if chunk_size is None:
+        chunk_size = getattr(settings, "IRRBB_PRICING_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+    return workers, chunk_size
+
+def _process_contracts(banco, curve_df, workers=None, chunk_size=None, valuation_date=None, on_contracts=None, progress=None, scenarios=None, portfolio=None, fingerprint=None):
+    workers, chunk_size = _pricing_options(workers, chunk_size)
+    if valuation_date is None:
+        valuation_date = date.today()
+    forward_only = getattr(settings, "IRRBB_FORWARD_ONLY_CASHFLOWS", False)
+
+    # los contratos se leen y valoran por trozos: solo se guardan sumas por producto
+    # (y, con on_contracts, los valores de cada contrato). portfolio: cartera ya cargada
+    # (p.ej. los pools) en vez de los contratos del banco. fingerprint: ContractFingerprint
+    # a la que se añaden los contratos leidos
+    if portfolio is None:
+        chunks = iter_portfolio(banco.contratos.all(), chunk_size)
+        if fingerprint is not None:
+            chunks = fingerprint.track(chunks)
+    else:
+        chunks = iter_chunks(portfolio, chunk_size)
+    accumulator = price_portfolio(
+        chunks, curve_df, valuation_date, forward_only=forward_only, workers=workers, on_contracts=on_contracts,
+        progress=progress, accumulator=PortfolioAccumulator(scenarios, _key_rate_tenors()), bucketed=_bucketed(),
+    )
+
+    return accumulator
+
+def _iter_changed_contracts(banco, numeros, chunk_size):
+    # cartera de los contratos con esos numeros, por trozos
+    numeros = list(numeros)
+    for start in range(0, len(numeros), chunk_size):
+        chunk = load_portfolio(banco.contratos.filter(numero_contrato__in=numeros[start:start + chunk_size]))
+        if len(chunk["id"]):
+            yield chunk
+
+def _incremental_accumulator(banco, curve_df, valuation_date, version, changes, workers=None, chunk_size=None, progress=None, scenarios=None, fingerprint=None):
+    # Parte del ultimo resultado con la misma version de curva: resta las contribuciones
+    # guardadas de los contratos borrados o modificados y suma las de los nuevos o
+    # modificados. Los flujos por dia (PerfilFlujos) se actualizan igual, regenerando los
+    # flujos de los contratos que salen con las condiciones guardadas en su contribucion.
+    # Devuelve None si no se puede (no hay resultado previo, faltan contribuciones, el
+    # cambio es demasiado grande o la cartera de antes de la importacion no es la valorada)
+    # y hay que valorar todo. fingerprint: ContractFingerprint donde queda la huella de la
+    # cartera actual.
+    workers, chunk_size = _pricing_options(workers, chunk_size)
+    previo = banco.resultados.order_by("-fecha_calculo", "-id").first()
+    metadata = previo.metadata if previo is not None else {}
+    if metadata.get("curve_version") != version or "activos" not in metadata or "pasivos" not in metadata:
+        return None
+    if "contracts_fingerprint" not in metadata:
+        return None
+    # desgloses guardados antes de tener bandas o con otros tipos clave
+    tenors = _key_rate_tenors()
+    if tuple(metadata.get("key_rate_tenors", ())) != tenors:
+        return None
+    for productos in (metadata["activos"], metadata["pasivos"]):
+        if any("gap" not in datos for datos in productos.values()):
+            return None
+    perfil = PerfilFlujos.objects.filter(banco=banco, curve_version=version).first()
+    if perfil is None:
+        return None
+
+    salen = list(changes["removed"]) + list(changes["changed"])
+    entran = list(changes["added"]) + list(changes["changed"])
+    n_previo = sum(datos.get("count", 0) for productos in (metadata["activos"], metadata["pasivos"]) for datos in productos.values())
+    max_fraction = getattr(settings, "IRRBB_INCREMENTAL_MAX_FRACTION", 0.25)
+    if len(salen) + len(entran) > max_fraction * max(n_previo, 1):
+        return None
+
+    antiguos = contributions.load_contributions(banco, version, salen, scenarios)
+    if len(antiguos["numero_contrato"]) != len(salen) or np.isnat(antiguos["fecha_inicio"]).any():
+        return None
+
+    forward_only = getattr(settings, "IRRBB_FORWARD_ONLY_CASHFLOWS", False)
+    accumulator = PortfolioAccumulator.from_breakdown(metadata["activos"], metadata["pasivos"], scenarios, tenors)
+    accumulator.profile = CashflowProfile.from_bytes(perfil.datos)
+    # huella de la cartera antes de la importacion: la actual sin los contratos que entran y
+    # con las condiciones guardadas de los que salen
+    previa = contributions.ContractFingerprint()
+    previa.add(antiguos)
+    # EVE/NII de los que salen son los guardados; los agregados de sus flujos se regeneran
+    salida = price_contracts(antiguos, curve_df, valuation_date, forward_only, scenarios, _bucketed(), tenors)[2] if salen else None
+    accumulator.add_contracts(antiguos, antiguos["eve"], antiguos["nii"], sign=-1, flows=salida)
+    contributions.delete_contributions(banco, version, salen)
+
+    price_portfolio(
+        previa.track(_iter_changed_contracts(banco, entran, chunk_size), sign=-1), curve_df, valuation_date, forward_only=forward_only,
+        workers=workers, accumulator=accumulator, on_contracts=contributions.ContributionWriter(banco, version),
+        progress=progress, bucketed=_bucketed(),
+    )
+
+    # si la cartera no cuadra (contratos tocados fuera de la importacion: admin, scripts, un
+    # trabajo anterior que importo pero no llego a valorar) se valora todo
+    if int(accumulator.counts.sum()) != banco.contratos.count():
+        return None
+    if fingerprint is None:
+        fingerprint = contributions.ContractFingerprint()
+    for _ in fingerprint.track(iter_portfolio(banco.contratos.all(), chunk_size)):
+        pass
+    previa.value = (previa.value + fingerprint.value) % contributions.FINGERPRINT_MOD
+    if previa.hexdigest() != metadata["contracts_fingerprint"]:
+        return None
+    return accumulator
 
 def _aggregate_results(activos, pasivos):
     eve_total = {"eve_base": 0, "eve_parallel_up": 0, "eve_parallel_down": 0,
@@ -77,17 +157,149 @@ def _aggregate_results(activos, pasivos):
 
     return eve_total, nii_total
 
+def _dv01(activos, pasivos):
+    # DV01 del balance: suma de los PV01 por tipo clave de todos los productos
+    return float(sum(sum(datos["krd"].values()) for productos in (activos, pasivos) for datos in productos.values()))
+
+
+def _scenario_totals(activos, pasivos, scenarios):
+    # total de cada metrica (eve_* / nii_*) del ScenarioSet
+    totals = dict.fromkeys([*scenarios.eve, *scenarios.nii], 0.0)
+    for productos in [activos, pasivos]:
+        for datos in productos.values():
+            for key, value in datos.get("scenario", {}).items():
+                if key in totals:
+                    totals[key] += value
+    return totals
+
+def _pooled_run(banco, curve_df, valuation_date, pooling, progress=None, scenarios=None, fingerprint=None):
+    # Valora los pools (pooling.py) en vez de los contratos. Con IRRBB_POOLING_CHECK valora
+    # tambien la cartera contrato a contrato y guarda el error de cada metrica total.
+    _, chunk_size = _pricing_options(None, None)
+    start = time.perf_counter()
+    chunks = iter_portfolio(banco.contratos.all(), chunk_size)
+    if fingerprint is not None:
+        chunks = fingerprint.track(chunks)
+    pools = pool_portfolio(chunks, **pooling)
+    accumulator = _process_contracts(
+        banco, curve_df, valuation_date=valuation_date, progress=progress, scenarios=scenarios, portfolio=pools
+    )
+    report = {
+        **pooling,
+        "contracts": portfolio_size(pools),
+        "pools": len(pools["id"]),
+        "seconds": time.perf_counter() - start,
+        "exact_seconds": None,
+        "error": None,
+    }
+    if getattr(settings, "IRRBB_POOLING_CHECK", False):
+        start = time.perf_counter()
+        exact = _process_contracts(banco, curve_df, valuation_date=valuation_date, scenarios=scenarios)
+        report["exact_seconds"] = time.perf_counter() - start
+        pooled_totals = _scenario_totals(*accumulator.breakdown(), scenarios)
+        exact_totals = _scenario_totals(*exact.breakdown(), scenarios)
+        report["error"] = {
+            name: {
+                "pooled": pooled_totals[name],
+                "exact": exact_totals[name],
+                "error": pooled_totals[name] - exact_totals[name],
+                "relative": (pooled_totals[name] - exact_totals[name]) / abs(exact_totals[name]) if exact_totals[name] else None,
+            }
+            for name in exact_totals
+        }
+    return accumulator, report
+
+def _sweep_results(profile, curve_df):
+    # perfil de EVE / NII frente al nivel de shock (IRRBB_SWEEP_SHOCKS_BP = (desde, hasta, paso))
+    sweep_range = getattr(settings, "IRRBB_SWEEP_SHOCKS_BP", DEFAULT_SWEEP_RANGE)
+    if not sweep_range:
+        return None
+    shapes = getattr(settings, "IRRBB_SWEEP_SHAPES", SWEEP_SHAPES)
+    return shock_sweep(profile, curve_df, sweep_shocks(*sweep_range), shapes)
+
+def _simulation_results(profile, curve_df):
+    # EVE / NII at risk con curvas simuladas (IRRBB_SIMULATION_PATHS = 0 para no calcularlo)
+    n_paths = getattr(settings, "IRRBB_SIMULATION_PATHS", 0)
+    if not n_paths:
+        return None
+    return simulate_profile(
+        profile, curve_df,
+        getattr(settings, "IRRBB_SIMULATION_MODEL", DEFAULT_MODEL),
+        n_paths,
+        horizon_years=getattr(settings, "IRRBB_SIMULATION_HORIZON_YEARS", 1.0),
+        quantiles=getattr(settings, "IRRBB_SIMULATION_QUANTILES", DEFAULT_QUANTILES),
+        confidence=getattr(settings, "IRRBB_SIMULATION_CONFIDENCE", 0.99),
+        seed=getattr(settings, "IRRBB_SIMULATION_SEED", None),
+    )
+
+def _nii_projection_results(profile, curve_df, scenarios):
+    # NII mes a mes de cada escenario a IRRBB_NII_PROJECTION_HORIZONS años (vacio para no calcularlo)
+    horizons = getattr(settings, "IRRBB_NII_PROJECTION_HORIZONS", DEFAULT_HORIZONS)
+    if not horizons:
+        return None
+    return project_nii(
+        profile, curve_df, horizons, scenarios.nii, getattr(settings, "IRRBB_NII_CONSTANT_BALANCE", True)
+    )
+
+def _save_scenario_results(resultado, activos, pasivos, scenarios):
+    definiciones = {d["codigo"]: d for d in scenarios.definitions}
+    filas = []
+    for name, value in _scenario_totals(activos, pasivos, scenarios).items():
+        # eve_<codigo> / nii_<codigo>
+        metrica, codigo = name.split("_", 1)
+        filas.append(ResultadoEscenario(
+            resultado=resultado, metrica=metrica.upper(), escenario=codigo, valor=value,
+            definicion=definiciones.get(codigo, {}),
+        ))
+    ResultadoEscenario.objects.bulk_create(filas)
+
 @transaction.atomic
-def run_balance_pricing(banco: Banco, uploaded_by=None):
-    contratos_qs = banco.contratos.all()
-    
-    contratos = list(contratos_qs)
-    if not contratos:
+def run_balance_pricing(banco: Banco, uploaded_by=None, changes=None, progress=None):
+    # changes: informe de la importacion (added / changed / removed). Con el se recalcula
+    # solo lo que ha cambiado si hay contribuciones guardadas para la curva de hoy.
+    # progress(hechos, total) se llama con los contratos valorados.
+    if not banco.contratos.exists():
         return None
 
-    curve_df = build_default_curve()
-    
-    activos, pasivos = _process_contracts(banco, curve_df)
+    valuation_date = date.today()
+    # cada contrato se valora con la curva de su curva_asociada (o la por defecto), con una
+    # columna mas por cada escenario de usuario activo
+    scenarios = load_scenario_set()
+    curve_df = scenarios.apply(curves_for_bank(banco, valuation_date))
+    pooling = _pooling()
+    version = contributions.curve_version(
+        curve_df, valuation_date, getattr(settings, "IRRBB_FORWARD_ONLY_CASHFLOWS", False), scenarios, _bucketed(), pooling
+    )
+
+    accumulator = None
+    pooling_report = None
+    fingerprint = contributions.ContractFingerprint()
+    # con pools no hay valores por contrato que restar: siempre se valora todo
+    if changes is not None and pooling is None:
+        total = len(changes["added"]) + len(changes["changed"])
+        accumulator = _incremental_accumulator(
+            banco, curve_df, valuation_date, version, changes,
+            progress=(lambda done: progress(done, total)) if progress is not None else None, scenarios=scenarios,
+            fingerprint=fingerprint,
+        )
+    if accumulator is None:
+        fingerprint = contributions.ContractFingerprint()
+        total = banco.contratos.count()
+        banco.contribuciones.all().delete()
+        on_progress = (lambda done: progress(done, total)) if progress is not None else None
+        if pooling is None:
+            accumulator = _process_contracts(
+                banco, curve_df, valuation_date=valuation_date, on_contracts=contributions.ContributionWriter(banco, version),
+                progress=on_progress, scenarios=scenarios, fingerprint=fingerprint,
+            )
+        else:
+            accumulator, pooling_report = _pooled_run(
+                banco, curve_df, valuation_date, pooling, on_progress, scenarios, fingerprint
+            )
+    activos, pasivos = accumulator.breakdown()
+    PerfilFlujos.objects.update_or_create(
+        banco=banco, defaults={"curve_version": version, "datos": accumulator.profile.to_bytes()}
+    )
     
     eve_results, nii_results = _aggregate_results(activos, pasivos)
 
@@ -104,6 +316,27 @@ def run_balance_pricing(banco: Banco, uploaded_by=None):
         nii_base = nii_results.get("nii_base", 0),
         nii_parallel_up = nii_results.get("nii_parallel_up", 0),
         nii_parallel_down = nii_results.get("nii_parallel_down", 0),
+        metadata = {
+            "activos": activos,
+            "pasivos": pasivos,
+            "curve_version": version,
+            "contracts_fingerprint": fingerprint.hexdigest(),
+            "key_rate_tenors": list(accumulator.key_rate_tenors),
+            "dv01": _dv01(activos, pasivos),
+            "sweep": _sweep_results(accumulator.profile, curve_df),
+            "simulation": _simulation_results(accumulator.profile, curve_df),
+            "nii_projection": _nii_projection_results(accumulator.profile, curve_df, scenarios),
+            "pooling": pooling_report,
+        },
     )
+    _save_scenario_results(resultado, activos, pasivos, scenarios)
+
+    return {"activos": activos, "pasivos": pasivos, "resultado": resultado}
 
-    return {"activos": activos, "pasivos": pasivos, "resultado": resultado}
\ No newline at end of file
+def get_breakdown(resultado):
+    # desglose por producto guardado al valorar; (None, None) en los resultados antiguos
+    # sin desglose (no se recalcula: la cartera y las curvas de hoy no son las de entonces)
+    metadata = resultado.metadata or {}
+    if "activos" not in metadata or "pasivos" not in metadata:
+        return None, None
+    return metadata["activos"], metadata["pasivos"]
@@ -0,0 +1,145 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
+from ..models import ContribucionContrato
+from .curve import curves_key
+from .portfolio import AMORTIZATION_CODES, PORTFOLIO_FIELDS, portfolio_from_rows
+from .scenarios import DEFAULT_SCENARIOS
+
+# Contribucion de cada contrato a cada escenario, guardada para que tras una subida
+# pequeña solo se valoren los contratos nuevos o modificados.
+
+DEFAULT_BATCH_SIZE = 2000
+AMORTIZATION_NAMES = {code: name for name, code in AMORTIZATION_CODES.items()}
+
+
+def _batch_size():
+    return getattr(settings, "IRRBB_IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+
+
+def curve_version(curves, valuation_date, forward_only=False, scenarios=None, bucketed=False, pooling=None):
+    # las contribuciones solo valen para las mismas curvas, fecha de valoracion, modo de
+    # flujos, escenarios y modo de valoracion (flujo a flujo o por bandas, con o sin pools)
+    digest = hashlib.sha1(curves_key(curves).encode())
+    digest.update(f"{valuation_date.isoformat()}|{int(bool(forward_only))}".encode())
+    if scenarios is not None and scenarios.key():
+        digest.update(f"|{scenarios.key()}".encode())
+    if bucketed:
+        digest.update(b"|bucketed")
+    if pooling:
+        digest.update(f"|pool|{pooling['maturity_months']}|{pooling['rate_band_bp']}|{pooling['start_months']}".encode())
+    return digest.hexdigest()
+
+
+def encode_values(eve, nii):
+    # fila de EVE + fila de NII -> bytes float64
+    return np.concatenate([eve, nii]).astype(np.float64).tobytes()
+
+
+class ContributionWriter:
+    # callback de price_portfolio(on_contracts=...): guarda los valores de cada contrato
+    def __init__(self, banco, version, batch_size=None):
+        self.banco = banco
+        self.version = version
+        self.batch_size = batch_size or _batch_size()
+
+    def __call__(self, portfolio, eve, nii):
+        contribuciones = [
+            ContribucionContrato(
+                banco=self.banco,
+                curve_version=self.version,
+                numero_contrato=portfolio["numero_contrato"][i],
+                producto=portfolio["producto"][i],
+                activo_pasivo=portfolio["activo_pasivo"][i],
+                nominal=nominal,
+                fecha_inicio=inicio,
+                fecha_vencimiento=fin,
+                tipo_interes="VARIABLE" if floating else "FIJO",
+                tipo_amortizacion=AMORTIZATION_NAMES[amortizacion],
+                cupon_spread=spread,
+                frecuencia_cupon=frecuencia,
+                curva_asociada=portfolio["curva_asociada"][i],
+                valores=encode_values(eve[i], nii[i]),
+            )
+            for i, (nominal, inicio, fin, floating, amortizacion, spread, frecuencia) in enumerate(zip(
+                portfolio["nominal"].tolist(), portfolio["fecha_inicio"].tolist(), portfolio["fecha_vencimiento"].tolist(),
+                portfolio["is_floating"].tolist(), portfolio["amortizacion"].tolist(), portfolio["cupon_spread"].tolist(),
+                portfolio["frecuencia_cupon"].tolist(),
+            ))
+        ]
+        ContribucionContrato.objects.bulk_create(contribuciones, batch_size=self.batch_size)
+
+
+def load_contributions(banco, version, numeros, scenarios=None, batch_size=None):
+    # contribuciones guardadas de esos numeros de contrato, con el formato de cartera
+    # (load_portfolio; "id" es el de la contribucion) + matrices eve / nii. Las guardadas
+    # antes de tener condiciones traen fechas NaT.
+    if scenarios is None:
+        scenarios = DEFAULT_SCENARIOS
+    batch_size = batch_size or _batch_size()
+    numeros = list(numeros)
+    rows = []
+    for start in range(0, len(numeros), batch_size):
+        rows.extend(
+            ContribucionContrato.objects.filter(
+                banco=banco, curve_version=version, numero_contrato__in=numeros[start:start + batch_size]
+            ).values_list(*PORTFOLIO_FIELDS, "valores")
+        )
+
+    n_eve = len(scenarios.eve)
+    n_columns = n_eve + len(scenarios.nii)
+    valores = np.frombuffer(b"".join(bytes(row[-1]) for row in rows), dtype=np.float64).reshape(len(rows), n_columns)
+    return {
+        **portfolio_from_rows([row[:-1] for row in rows]),
+        "eve": valores[:, :n_eve],
+        "nii": valores[:, n_eve:],
+    }
+
+
+@transaction.atomic
+def delete_contributions(banco, version, numeros, batch_size=None):
+    batch_size = batch_size or _batch_size()
+    numeros = list(numeros)
+    for start in range(0, len(numeros), batch_size):
+        ContribucionContrato.objects.filter(
+            banco=banco, curve_version=version, numero_contrato__in=numeros[start:start + batch_size]
+        ).delete()
+
+
+# condiciones que entran en la huella de la cartera (todas menos el id de la fila)
+FINGERPRINT_FIELDS = tuple(field for field in portfolio_from_rows([]) if field != "id")
+FINGERPRINT_MOD = 1 << 64
+
+
+class ContractFingerprint:
+    # Huella de una cartera: suma (mod 2^64) de un hash de las condiciones de cada contrato.
+    # Al ser una suma se puede actualizar restando y sumando contratos, asi que la huella
+    # de la cartera antes de una importacion sale de la de despues y de los contratos que
+    # han cambiado. Cualquier cambio hecho fuera de la importacion (admin, scripts, un
+    # trabajo fallido) deja una huella distinta.
+    def __init__(self):
+        self.value = 0
+
+    def add(self, portfolio, sign=1):
+        # hash de cada fila con pandas (vectorizado y estable entre procesos); la suma en
+        # uint64 ya es modulo 2^64
+        frame = pd.DataFrame({field: portfolio[field] for field in FINGERPRINT_FIELDS})
+        total = int(pd.util.hash_pandas_object(frame, index=False).to_numpy().sum(dtype=np.uint64))
+        self.value = (self.value + sign * total) % FINGERPRINT_MOD
+
+    def track(self, chunks, sign=1):
+        # añade (o resta) cada trozo de cartera (iter_portfolio) a la huella al recorrerlo
+        for chunk in chunks:
+            self.add(chunk, sign)
+            yield chunk
+
+    def hexdigest(self):
+        return f"{self.value:016x}"
+
+
+def contribution_count(banco, version):
+    return ContribucionContrato.objects.filter(banco=banco, curve_version=version).count()
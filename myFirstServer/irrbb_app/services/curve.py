@@ -1,6 +1,11 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
-from .utils import normalize_curve_points
+from .utils import interpolate_columns, interpolation_weights, normalize_curve_points
 
 EUR_SHOCKS_BP = {
     "parallel": 225,
@@ -36,12 +41,255 @@ class Curve:
 
         return curve
 
+# ---------------------------------------------------------------------------
+# Cache de curvas construidas (una por proceso para cada puntos + shocks)
+# ---------------------------------------------------------------------------
+
+CURVE_CACHE_SIZE = 32
+
+_CURVE_CACHE = OrderedDict()
+_CURVE_CACHE_LOCK = threading.Lock()
+
+
+def curve_points_key(plazos, tipos, shocks=None):
+    # huella de los datos de entrada: plazos, tipos y shocks en pb
+    if shocks is None:
+        shocks = EUR_SHOCKS_BP
+    payload = json.dumps([[str(p) for p in plazos], [float(t) for t in tipos], sorted(shocks.items())])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _read_only_frame(df):
+    # mismas columnas sobre arrays numpy no modificables
+    columns = {}
+    for col in df.columns:
+        values = np.array(df[col].to_numpy(), copy=True)
+        values.setflags(write=False)
+        columns[col] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def _new_curve(plazos, tipos):
+    maturities, rates = normalize_curve_points(plazos, tipos)
+    if len(maturities) != len(rates) or len(rates) == 0:
+        raise ValueError("La curva necesita el mismo numero de plazos y tipos")
+    df_flatcurve = pd.DataFrame({"maturity_years": maturities, "rate_flat_curve": rates,})
+    # los puntos se ordenan por plazo para interpolar
+    df_flatcurve = df_flatcurve.sort_values("maturity_years", kind="stable").reset_index(drop=True)
+
+    curve = Curve(df_flatcurve)
+    curve.df_flatcurve = _read_only_frame(curve.df_flatcurve)
+    curve.curves = _read_only_frame(curve.curves)
+    return curve
+
+
+def get_curve(plazos, tipos):
+    # Curve compartida por todo el proceso; sus DataFrames son de solo lectura
+    key = curve_points_key(plazos, tipos)
+    with _CURVE_CACHE_LOCK:
+        curve = _CURVE_CACHE.get(key)
+        if curve is not None:
+            _CURVE_CACHE.move_to_end(key)
+            return curve
+
+    curve = _new_curve(plazos, tipos)
+    with _CURVE_CACHE_LOCK:
+        curve = _CURVE_CACHE.setdefault(key, curve)
+        _CURVE_CACHE.move_to_end(key)
+        if len(_CURVE_CACHE) > CURVE_CACHE_SIZE:
+            _CURVE_CACHE.popitem(last=False)
+    return curve
+
+
+def invalidate_curve_cache():
+    # al cambiar datos de curvas (o EUR_SHOCKS_BP): se descartan curvas y tablas diarias
+    with _CURVE_CACHE_LOCK:
+        _CURVE_CACHE.clear()
+    with _GRID_CACHE_LOCK:
+        _GRID_CACHE.clear()
+
+
+def build_curve(plazos, tipos):
+    # plazos del tipo ["1M", "1Y"..] y tipos en tanto por uno -> DataFrame con las curvas de
+    # escenario (rate_*_curve en pb). Se devuelve una copia ligera de la curva cacheada: con
+    # copy-on-write quien la modifique trabaja sobre su copia y no sobre la compartida.
+    return get_curve(plazos, tipos).curves.copy(deep=False)
+
 def build_default_curve():
     default_plazos = ["1M", "3M", "6M", "1Y", "2Y", "3Y", "5Y", "10Y"]
     default_rates = [0.02, 0.0225, 0.025, 0.0275, 0.03, 0.032, 0.035, 0.037]
-    maturities, rates = normalize_curve_points(default_plazos, default_rates)
     # maturities es del tipo [0.0833,0.25..], rates es del tipo [0.02,0.025..]
+    return build_curve(default_plazos, default_rates)
 
-    df_flatcurve = pd.DataFrame({"maturity_years": maturities, "rate_flat_curve": rates,})
-    
-    return Curve(df_flatcurve).curves
+
+class CurveSet:
+    # Curvas de una cartera por nombre (Contrato.curva_asociada). Los nombres sin curva
+    # registrada se valoran con la curva por defecto.
+    def __init__(self, default, curves=None):
+        self.default = default
+        self.curves = dict(curves or {})
+
+    def get(self, name):
+        return self.curves.get(name, self.default)
+
+    def key(self):
+        if not self.curves:
+            return curve_key(self.default)
+        digest = hashlib.sha1(curve_key(self.default).encode())
+        for name in sorted(self.curves):
+            digest.update(f"|{name}={curve_key(self.curves[name])}".encode())
+        return digest.hexdigest()
+
+    def split(self, names):
+        # -> [(posiciones, curve_df)] con los contratos agrupados por curva
+        names = np.asarray(names, dtype=object).astype(str)
+        uniq, inverse = np.unique(names, return_inverse=True)
+        registered = [name for name in uniq.tolist() if name in self.curves]
+        # 0 = curva por defecto, 1.. = curvas registradas en el orden de registered
+        code = np.array([registered.index(name) + 1 if name in self.curves else 0 for name in uniq.tolist()], dtype=np.int64)
+        curve_of_contract = code[inverse]
+        groups = []
+        for c, curve_df in enumerate([self.default] + [self.curves[name] for name in registered]):
+            rows = np.flatnonzero(curve_of_contract == c)
+            if len(rows):
+                groups.append((rows, curve_df))
+        return groups
+
+
+def curve_groups(curves, portfolio):
+    # curves puede ser un DataFrame (una curva para todo) o un CurveSet
+    if isinstance(curves, CurveSet):
+        if not curves.curves:
+            return [(slice(None), curves.default)]
+        return curves.split(portfolio["curva_asociada"])
+    return [(slice(None), curves)]
+
+
+def curves_key(curves):
+    return curves.key() if isinstance(curves, CurveSet) else curve_key(curves)
+
+
+def curves_by_key(curves):
+    # {curve_key: DataFrame} de todas las curvas (las claves de CashflowProfile)
+    frames = [curves.default, *curves.curves.values()] if isinstance(curves, CurveSet) else [curves]
+    return {curve_key(df): df for df in frames}
+
+
+# ---------------------------------------------------------------------------
+# Tabla diaria de tipos / factores de descuento por escenario
+# ---------------------------------------------------------------------------
+
+GRID_DAYS_BLOCK = 3650  # la tabla crece de 10 en 10 años
+GRID_CACHE_SIZE = 16
+
+
+def curve_columns(curve_df):
+    return [col for col in curve_df.columns if col.startswith("rate_") and col != "rate_flat_curve"]
+
+
+def curve_key(curve_df):
+    # huella del contenido de la curva: mismas columnas y valores -> misma tabla
+    columns = ["maturity_years"] + curve_columns(curve_df)
+    digest = hashlib.sha1("|".join(columns).encode())
+    digest.update(np.ascontiguousarray(curve_df[columns].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def cashflow_days(cashflows):
+    # dias desde la fecha de valoracion de cada flujo (year = dias / 360)
+    if "day" in cashflows:
+        return np.asarray(cashflows["day"], dtype=np.int64)
+    return np.rint(np.asarray(cashflows["year"], dtype=np.float64) * 360).astype(np.int64)
+
+
+class CurveGrid:
+    # Para cada dia d (t = d/360) y cada curva de escenario guarda el tipo interpolado,
+    # el factor de descuento 1/(1+r)^t y el forward diario entre d y d+1.
+    # Se calcula bajo demanda y se amplia si llega un flujo mas lejano.
+    def __init__(self, curve_df):
+        self.columns = curve_columns(curve_df)
+        self.column_index = {col: i for i, col in enumerate(self.columns)}
+        self.maturities = curve_df["maturity_years"].to_numpy(dtype=np.float64).copy()
+        self.points = curve_df[self.columns].to_numpy(dtype=np.float64) / 10000
+        self.n_days = 0
+        self.rates = np.empty((0, len(self.columns)))
+        self.discount = np.empty((0, len(self.columns)))
+        self.forwards = np.empty((0, len(self.columns)))
+        self._key_rates = {}
+        self._lock = threading.Lock()
+
+    def ensure(self, max_day):
+        if max_day < self.n_days:
+            return
+        with self._lock:
+            if max_day < self.n_days:
+                return
+            n_days = (max_day // GRID_DAYS_BLOCK + 1) * GRID_DAYS_BLOCK
+            years = np.arange(n_days + 1) / 360
+            rates = interpolate_columns(years, self.maturities, self.points)
+            discount = np.exp(-years[:, None] * np.log1p(rates))
+            forwards = np.power(discount[:-1] / discount[1:], 360) - 1
+            for table in (rates, discount, forwards):
+                table.setflags(write=False)
+            # se publican ya calculadas: otros hilos ven la tabla vieja o la nueva completa
+            self.rates, self.discount, self.forwards = rates[:-1], discount[:-1], forwards
+            self.n_days = n_days
+
+    def _table(self, table, columns, max_day):
+        self.ensure(max_day)
+        index = [self.column_index[col] for col in columns]
+        return getattr(self, table)[: max_day + 1, index]
+
+    def discount_factors(self, columns, max_day):
+        # matriz (dias 0..max_day) x columnas
+        return self._table("discount", columns, max_day)
+
+    def rate_table(self, columns, max_day):
+        return self._table("rates", columns, max_day)
+
+    def forward_table(self, columns, max_day):
+        return self._table("forwards", columns, max_day)
+
+    def key_rate_table(self, key_rate_years, max_day):
+        # matriz dias x tipos clave: cambio del factor de descuento base de cada dia si el
+        # tipo clave k sube 1pb (bump triangular hasta los tipos clave vecinos, plano fuera
+        # de los extremos). Sumando las columnas sale el de un desplazamiento paralelo.
+        self.ensure(max_day)
+        key = tuple(float(y) for y in key_rate_years)
+        table = self._key_rates.get(key)
+        if table is None or len(table) <= max_day:
+            with self._lock:
+                base = self.column_index["rate_base_curve"]
+                discount, rates = self.discount[:, base], self.rates[:, base]
+                rows = np.arange(len(discount))
+                years = rows / 360
+                i, w = interpolation_weights(years, np.asarray(key))
+                weights = np.zeros((len(rows), len(key)))
+                np.add.at(weights, (rows, i), 1 - w)
+                if len(key) > 1:
+                    np.add.at(weights, (rows, i + 1), w)
+                # d/dr (1+r)^-t = -t (1+r)^(-t-1)
+                derivative = -years * discount / (1 + rates)
+                table = weights * (derivative / 10000)[:, None]
+                table.setflags(write=False)
+                self._key_rates[key] = table
+        return table[: max_day + 1]
+
+
+_GRID_CACHE = OrderedDict()
+_GRID_CACHE_LOCK = threading.Lock()
+
+
+def curve_grid(curve_df):
+    # una tabla por curva, compartida entre productos y peticiones del mismo proceso
+    key = curve_key(curve_df)
+    with _GRID_CACHE_LOCK:
+        grid = _GRID_CACHE.get(key)
+        if grid is None:
+            grid = CurveGrid(curve_df)
+            _GRID_CACHE[key] = grid
+            if len(_GRID_CACHE) > GRID_CACHE_SIZE:
+                _GRID_CACHE.popitem(last=False)
+        else:
+            _GRID_CACHE.move_to_end(key)
+    return grid
@@ -0,0 +1,71 @@
+from ..models import Curva, Escenario
+from .curve import CurveSet, build_curve, build_default_curve
+from .scenarios import ScenarioSet, validate_scenario
+
+# Registro de curvas guardadas en base de datos (modelo Curva). Cada valoracion crea un
+# CurveRegistry con su fecha y cada (nombre, fecha) se lee y se construye una sola vez.
+
+
+class CurveRegistry:
+    def __init__(self, fecha):
+        self.fecha = fecha
+        self._curves = {}  # (nombre, fecha de la curva) -> DataFrame de escenarios
+        self._resolved = {}  # nombre -> (nombre, fecha) o None si no hay curva registrada
+        self._default = None
+
+    def default(self):
+        if self._default is None:
+            self._default = build_default_curve()
+        return self._default
+
+    def _resolve(self, nombres):
+        # ultima curva de cada nombre con fecha <= fecha de valoracion, en una sola consulta
+        pendientes = {nombre for nombre in nombres if nombre not in self._resolved}
+        if not pendientes:
+            return
+        curvas = Curva.objects.filter(nombre__in=pendientes, fecha__lte=self.fecha).order_by("nombre", "-fecha")
+        for curva in curvas:
+            if curva.nombre in self._resolved:
+                continue
+            key = (curva.nombre, curva.fecha)
+            if key not in self._curves:
+                try:
+                    self._curves[key] = build_curve(curva.plazos, curva.tipos)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"Curva {curva} no valida: {e}")
+            self._resolved[curva.nombre] = key
+        for nombre in pendientes:
+            self._resolved.setdefault(nombre, None)
+
+    def curve(self, nombre):
+        # DataFrame de escenarios de esa curva (la por defecto si no esta registrada)
+        self._resolve([nombre])
+        key = self._resolved[nombre]
+        return self._curves[key] if key is not None else self.default()
+
+    def curve_set(self, nombres):
+        nombres = set(nombres)
+        self._resolve(nombres)
+        registradas = {nombre: self._curves[self._resolved[nombre]] for nombre in nombres if self._resolved[nombre] is not None}
+        return CurveSet(self.default(), registradas)
+
+
+def curves_for_bank(banco, fecha, registry=None):
+    # curvas de todos los contratos del banco (por curva_asociada) a fecha de valoracion
+    if registry is None:
+        registry = CurveRegistry(fecha)
+    nombres = banco.contratos.values_list("curva_asociada", flat=True).distinct()
+    return registry.curve_set(nombres)
+
+
+def load_scenario_set():
+    # escenarios EBA + los escenarios de usuario activos (modelo Escenario)
+    # (se validan aqui tambien: una fila guardada sin pasar por clean() no debe romper la
+    # valoracion con un error poco claro)
+    definiciones = list(Escenario.objects.filter(activo=True).order_by("codigo").values("codigo", "tipo", "parametros"))
+    for definicion in definiciones:
+        try:
+            validate_scenario(definicion["codigo"], definicion["tipo"], definicion["parametros"])
+        except ValueError as e:
+            raise ValueError(f"Escenario {definicion['codigo']} no valido: {e}")
+    return ScenarioSet(definiciones)
@@ -1,6 +1,14 @@
 import numpy as np
 import pandas as pd
 
+from .curve import cashflow_days, curve_grid
+from .utils import tenors_to_years
+
+# tamaño maximo de la matriz grupos x dias que se agrega antes de descontar
+DENSE_GROUP_LIMIT = 5_000_000
+# tamaño maximo de la matriz dias x shocks de un bloque del barrido
+SWEEP_BLOCK_LIMIT = 2_000_000
+
 SCENARIO_COLUMNS = {
     "eve_base": "rate_base_curve",
     "eve_parallel_up": "rate_parallel_up_curve",
@@ -11,6 +19,9 @@ SCENARIO_COLUMNS = {
     "eve_flattener": "rate_flattener_curve",
 }
 
+# tipos clave para las sensibilidades (PV01 por plazo)
+KEY_RATE_TENORS = ("1M", "3M", "6M", "1Y", "2Y", "3Y", "5Y", "10Y")
+
 # valor presente de los flujos de caja bajo diferentes escenarios de curva de tasas
 def discount_cashflows(cashflows_df, curve_df, curve_column): 
     df = cashflows_df.copy()
@@ -19,11 +30,96 @@ def discount_cashflows(cashflows_df, curve_df, curve_column):
     return df
 
 
-def calculate_eve(cashflows_df, curve_df):
-    results = {}
+def group_day_totals(values, days, groups, n_groups, width):
+    # suma por (grupo, dia) -> matriz grupos x dias
+    return np.bincount(groups * width + days, weights=values, minlength=n_groups * width).reshape(n_groups, width)
+
+
+def grouped_product(values, days, groups, n_groups, table):
+    # sum_flujos values * table[dia, :] agregado por grupo -> matriz grupos x columnas.
+    # Con pocos grupos se agrega por dia antes de multiplicar; con muchos (p.ej. un grupo
+    # por contrato) se recorre la tabla flujo a flujo.
+    width = table.shape[0]
+    if n_groups * width <= DENSE_GROUP_LIMIT:
+        return group_day_totals(values, days, groups, n_groups, width) @ table
+    # columna a columna para no crear la matriz flujos x columnas
+    return np.column_stack([
+        np.bincount(groups, weights=table[:, j][days] * values, minlength=n_groups) for j in range(table.shape[1])
+    ])
+
+
+def calculate_eve_by_group(cashflows_df, curve_df, groups, n_groups, scenario_columns = None):
+    # EVE de cada grupo (producto, contrato...) en una sola pasada: matriz grupos x escenarios
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
+
+    days = cashflow_days(cashflows_df)
+    if len(days) == 0:
+        return np.zeros((n_groups, len(scenario_columns)))
+
+    max_day = int(days.max())
+    cashflow = np.asarray(cashflows_df["cashflow"], dtype=np.float64)
+    discount = curve_grid(curve_df).discount_factors(scenario_columns.values(), max_day)
+    return grouped_product(cashflow, days, np.asarray(groups, dtype=np.int64), n_groups, discount)
+
+
+def calculate_eve_krd_by_group(cashflows_df, curve_df, groups, n_groups, scenario_columns = None, key_rate_tenors = KEY_RATE_TENORS):
+    # EVE por escenario y PV01 por tipo clave (cambio del EVE base si el tipo clave sube 1pb)
+    # de cada grupo en la misma pasada: las columnas de sensibilidad se añaden a la tabla de
+    # factores de descuento antes de multiplicar. -> (grupos x escenarios, grupos x tipos clave)
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
+
+    days = cashflow_days(cashflows_df)
+    if len(days) == 0:
+        return np.zeros((n_groups, len(scenario_columns))), np.zeros((n_groups, len(key_rate_tenors)))
+
+    max_day = int(days.max())
+    cashflow = np.asarray(cashflows_df["cashflow"], dtype=np.float64)
+    grid = curve_grid(curve_df)
+    table = np.hstack([
+        grid.discount_factors(scenario_columns.values(), max_day),
+        grid.key_rate_table(tenors_to_years(key_rate_tenors), max_day),
+    ])
+    values = grouped_product(cashflow, days, np.asarray(groups, dtype=np.int64), n_groups, table)
+    return values[:, : len(scenario_columns)], values[:, len(scenario_columns):]
+
+
+def calculate_eve(cashflows_df, curve_df, scenario_columns = None):
+    # cashflows_df puede ser un DataFrame o la tabla columnar (dict de arrays).
+    # Los flujos se agregan por dia y se descuentan contra la tabla diaria de la curva.
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
+
+    groups = np.zeros(len(cashflows_df["year"]), dtype=np.int64)
+    pv = calculate_eve_by_group(cashflows_df, curve_df, groups, 1, scenario_columns)[0] # EVE total de cada escenario
+
+    return {scenario: float(value) for scenario, value in zip(scenario_columns, pv)}
+
+
+def calculate_eve_sweep(cashflows_df, curve_df, shocks_bp, shape=None):
+    # EVE con la curva base desplazada shocks_bp[k] * shape[dia] pb para todos los shocks de
+    # una vez: los flujos se agregan por dia y se descuentan contra una matriz dias x shocks
+    # (por bloques de shocks para acotar la memoria). shape: shock por pb de cada dia
+    # (None = paralelo), p.ej. scenarios.shock_by_day.
+    shocks_bp = np.asarray(shocks_bp, dtype=np.float64)
+    days = cashflow_days(cashflows_df)
+    if len(days) == 0:
+        return np.zeros(len(shocks_bp))
+
+    max_day = int(days.max())
+    by_day = np.bincount(days, weights=np.asarray(cashflows_df["cashflow"], dtype=np.float64), minlength=max_day + 1)
+    used = np.flatnonzero(by_day)
+    cashflow = by_day[used]
+    years = used / 360
+    base = curve_grid(curve_df).rate_table(["rate_base_curve"], max_day)[used, 0]
+    unit = np.full(len(used), 1 / 10000) if shape is None else np.asarray(shape)[used] / 10000
 
-    for scenario, col in SCENARIO_COLUMNS.items():
-        discoun_pv = discount_cashflows(cashflows_df, curve_df, col)
-        results[scenario] = float(discoun_pv["pv"].sum()) # EVE total de cada escenario
+    eve = np.empty(len(shocks_bp))
+    block = max(SWEEP_BLOCK_LIMIT // max(len(used), 1), 1)
+    for start in range(0, len(shocks_bp), block):
+        shocks = shocks_bp[start:start + block]
+        rates = base[:, None] + unit[:, None] * shocks[None, :]
+        eve[start:start + block] = cashflow @ np.exp(-years[:, None] * np.log1p(rates))
+    return eve
 
-    return results
\ No newline at end of file
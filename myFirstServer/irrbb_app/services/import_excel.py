@@ -1,90 +1,431 @@
+import importlib.util
+from itertools import islice
+
+import numpy as np
+import openpyxl
 import pandas as pd
+from django.conf import settings
+from django.db import transaction
+
 from ..models import Contrato
 
 
-def load_contracts_from_excel(archivo, banco, curva="EURIBOR"):
-    df = pd.read_excel(archivo)
-    df.columns = df.columns.str.lower()
-    for i, row in df.iterrows():
-        c = Contrato()
-        c.banco = banco
-        c.numero_contrato = row.get('numerocontrato', '')
-        c.producto = row.get('producto', '')
-        c.activo_pasivo = str(row.get('activopasivo', '')).upper()
-        c.nominal = row.get('nominal', 0)
-        c.fecha_inicio = pd.to_datetime(row.get('fechainicio')).date()
-        c.fecha_vencimiento = pd.to_datetime(row.get('fechavencimiento')).date()
-        c.tipo_interes = str(row.get('tipointeres', '')).upper()
-        c.tipo_amortizacion = str(row.get('amortizacion', '')).upper()
-        c.cupon_spread = row.get('cuponspread', 0)
-        c.curva_asociada = row.get('curva', curva)
-        c.frecuencia_cupon = row.get('frecuencia', 1)
-        c.save()
-
-    return len(df)
-
-def validate_contracts_excel(archivo):
-    errors = []
-    columns_required = ['numerocontrato', 'producto', 'activopasivo', 'nominal', 'fechainicio',
-                        'fechavencimiento', 'tipointeres', 'amortizacion', 'cuponspread', 'curva', 'frecuencia']
-    
-    df = pd.read_excel(archivo)
+COLUMNS_REQUIRED = ['numerocontrato', 'producto', 'activopasivo', 'nominal', 'fechainicio',
+                    'fechavencimiento', 'tipointeres', 'amortizacion', 'cuponspread', 'curva', 'frecuencia']
+
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_MAX_ERRORS = 100
+DEFAULT_CHUNK_SIZE = 10000
+
+IMPORT_MODES = ("upsert", "sync")
+
+
+class ContractImportError(Exception):
+    def __init__(self, errors):
+        super().__init__("; ".join(e["message"] for e in errors))
+        self.errors = errors
+
+
+# tipos explicitos para los lectores columnares (las fechas se convierten al validar)
+CONTRACT_DTYPES = {
+    'numerocontrato': "str",
+    'producto': "str",
+    'activopasivo': "str",
+    'nominal': "float64",
+    'fechainicio': "str",
+    'fechavencimiento': "str",
+    'tipointeres': "str",
+    'amortizacion': "str",
+    'cuponspread': "float64",
+    'curva': "str",
+    'frecuencia': "float64",
+}
+
+FORMAT_EXTENSIONS = {
+    ".xlsx": "xlsx",
+    ".xlsm": "xlsx",
+    ".csv": "csv",
+    ".txt": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+}
+
+
+def detect_format(archivo):
+    # por extension y, si no hay, por las primeras bytes del contenido
+    name = str(getattr(archivo, "name", archivo) or "").lower()
+    for extension, formato in FORMAT_EXTENSIONS.items():
+        if name.endswith(extension):
+            return formato
+
+    if hasattr(archivo, "read"):
+        archivo.seek(0)
+        magic = archivo.read(4)
+        archivo.seek(0)
+    else:
+        with open(archivo, "rb") as fh:
+            magic = fh.read(4)
+    if magic == b"PK\x03\x04":
+        return "xlsx"
+    if magic == b"PAR1":
+        return "parquet"
+    return "csv"
+
+
+def _rewind(archivo):
+    if hasattr(archivo, "seek"):
+        archivo.seek(0)
+
+
+def _csv_engine():
+    return "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+
+def _csv_options(archivo):
+    # dtype por nombre de columna real (las cabeceras pueden venir en mayusculas)
+    header = pd.read_csv(archivo, nrows=0).columns
+    _rewind(archivo)
+    dtype = {col: CONTRACT_DTYPES[col.lower()] for col in header if col.lower() in CONTRACT_DTYPES}
+    return {"dtype": dtype}
+
+
+def _read_csv(archivo, **kwargs):
+    # con tipos explicitos; si una columna numerica trae texto se lee todo como texto
+    # para que la validacion diga que fila falla
+    options = _csv_options(archivo)
+    try:
+        return pd.read_csv(archivo, **options, **kwargs)
+    except ValueError:
+        _rewind(archivo)
+        return pd.read_csv(archivo, dtype="str", **kwargs)
+
+
+def _parquet_file(archivo):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Para importar ficheros Parquet hace falta instalar pyarrow")
+    return pq.ParquetFile(archivo)
+
+
+def read_contracts_frame(archivo):
+    # se lee el fichero una sola vez; validacion y carga trabajan sobre este DataFrame
+    formato = detect_format(archivo)
+    if formato == "csv":
+        df = _read_csv(archivo, engine=_csv_engine())
+    elif formato == "parquet":
+        df = _parquet_file(archivo).read().to_pandas()
+    else:
+        df = pd.read_excel(archivo)
     df.columns = df.columns.str.lower()
+    return df
+
+
+def _contract_columns(df, curva):
+    # columnas del Excel -> valores de los campos de Contrato, ya convertidos
+    return {
+        "numero_contrato": df['numerocontrato'].astype(str).tolist(),
+        "producto": df['producto'].astype(str).tolist(),
+        "activo_pasivo": df['activopasivo'].astype(str).str.upper().tolist(),
+        "nominal": df['nominal'].astype(float).tolist(),
+        "fecha_inicio": _to_datetime(df['fechainicio']).dt.date.tolist(),
+        "fecha_vencimiento": _to_datetime(df['fechavencimiento']).dt.date.tolist(),
+        "tipo_interes": df['tipointeres'].astype(str).str.upper().tolist(),
+        "tipo_amortizacion": df['amortizacion'].astype(str).str.upper().tolist(),
+        "cupon_spread": df['cuponspread'].astype(float).tolist(),
+        "curva_asociada": df['curva'].fillna(curva).astype(str).tolist() if 'curva' in df else [curva] * len(df),
+        "frecuencia_cupon": df['frecuencia'].fillna(1).astype(int).tolist() if 'frecuencia' in df else [1] * len(df),
+    }
+
+
+def new_import_report():
+    # numeros de contrato dados de alta / modificados / borrados, para recalcular solo eso
+    return {"rows": 0, "added": [], "changed": [], "removed": [], "unchanged": 0}
+
+
+def _existing_contracts(banco, numeros, fields, batch_size):
+    # {numero_contrato: (id, valores actuales)} de los numeros que ya existen en el banco
+    existing = {}
+    for start in range(0, len(numeros), batch_size):
+        lote = numeros[start:start + batch_size]
+        for row in Contrato.objects.filter(banco=banco, numero_contrato__in=lote).values_list("id", *fields):
+            existing[row[1]] = (row[0], row[1:])
+    return existing
+
+
+def load_contracts_frame(df, banco, curva="EURIBOR", batch_size=None, report=None):
+    # Alta o actualizacion de los contratos de un DataFrame ya validado, con clave
+    # (banco, numero_contrato): bulk_create de los nuevos y bulk_update solo de los que cambian.
+    if batch_size is None:
+        batch_size = getattr(settings, "IRRBB_IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    if report is None:
+        report = new_import_report()
+
+    columns = _contract_columns(df, curva)
+    fields = list(columns)
+    existing = _existing_contracts(banco, columns["numero_contrato"], fields, batch_size)
+
+    nuevos = []
+    cambiados = []
+    for values in zip(*columns.values()):
+        actual = existing.get(values[0])
+        if actual is None:
+            nuevos.append(Contrato(banco=banco, **dict(zip(fields, values))))
+        elif actual[1] != values:
+            cambiados.append(Contrato(id=actual[0], banco=banco, **dict(zip(fields, values))))
+        else:
+            report["unchanged"] += 1
+
+    with transaction.atomic():
+        Contrato.objects.bulk_create(nuevos, batch_size=batch_size)
+        Contrato.objects.bulk_update(cambiados, fields[1:], batch_size=batch_size)
+
+    report["rows"] += len(df)
+    report["added"].extend(c.numero_contrato for c in nuevos)
+    report["changed"].extend(c.numero_contrato for c in cambiados)
+    return report
+
+
+def remove_missing_contracts(banco, numeros_vistos, batch_size=None, report=None):
+    # borra los contratos del banco que no venian en el fichero (modo sync)
+    if batch_size is None:
+        batch_size = getattr(settings, "IRRBB_IMPORT_BATCH_SIZE", DEFAULT_BATCH_SIZE)
+    if report is None:
+        report = new_import_report()
+
+    sobrantes = [
+        (pk, numero)
+        for pk, numero in banco.contratos.values_list("id", "numero_contrato").iterator(chunk_size=batch_size)
+        if numero not in numeros_vistos
+    ]
+    with transaction.atomic():
+        for start in range(0, len(sobrantes), batch_size):
+            Contrato.objects.filter(id__in=[pk for pk, _ in sobrantes[start:start + batch_size]]).delete()
+
+    report["removed"].extend(numero for _, numero in sobrantes)
+    return report
+
+
+def load_contracts_from_excel(archivo, banco, curva="EURIBOR"):
+    return load_contracts_frame(read_contracts_frame(archivo), banco, curva)["rows"]
+
+def validate_contracts_excel(archivo, max_errors=None):
+    return validate_contracts_frame(read_contracts_frame(archivo), max_errors)
+
+
+def _to_datetime(column):
+    # conversion rapida; solo los valores que no encajan con el formato inferido se
+    # vuelven a intentar uno a uno
+    fechas = pd.to_datetime(column, errors="coerce")
+    retry = fechas.isna() & column.notna()
+    if retry.any():
+        fechas[retry] = pd.to_datetime(column[retry], errors="coerce", format="mixed")
+    return fechas
+
+
+def _validation_checks(df, seen=None):
+    # (campo, regla, mascara de filas con error, texto) en el orden en que se informan.
+    # seen: {numero_contrato: fila} de los trozos anteriores del mismo fichero
+    numeros = df['numerocontrato'].astype(str)
+    repetido = numeros.duplicated()
+    if seen:
+        repetido |= numeros.map(seen).notna()
+    nominal = pd.to_numeric(df['nominal'], errors="coerce")
+    spread = pd.to_numeric(df['cuponspread'], errors="coerce")
+    start_date = _to_datetime(df['fechainicio'])
+    finish_date = _to_datetime(df['fechavencimiento'])
+    fechas_validas = start_date.notna() & finish_date.notna()
+
+    def not_in(col, values):
+        return ~df[col].astype(str).str.upper().isin(values)
+
+    return [
+        ("numerocontrato", "required", df['numerocontrato'].isna(), "NumeroContrato está vacío."),
+        ("numerocontrato", "unique", df['numerocontrato'].notna() & repetido, "NumeroContrato repetido en el fichero"),
+        ("activopasivo", "enum", not_in('activopasivo', ['ACTIVO', 'PASIVO']), "ActivoPasivo debe ser 'ACTIVO' o 'PASIVO'."),
+        ("nominal", "numeric", nominal.isna(), "Nominal debe ser un número válido."),
+        ("nominal", "positive", nominal < 0, "Nominal debe ser un número positivo."),
+        ("fechainicio", "date", ~fechas_validas, "Fechas no válidas."),
+        ("fechainicio", "date_order", fechas_validas & (start_date >= finish_date), "FechaInicio debe ser anterior a FechaVencimiento."),
+        ("tipointeres", "enum", not_in('tipointeres', ['FIJO', 'VARIABLE']), "TipoInteres debe ser 'FIJO' o 'VARIABLE'."),
+        ("amortizacion", "enum", not_in('amortizacion', ['FRANCESA', 'ALEMANA', 'BULLET']), "Amortizacion debe ser 'FRANCESA', 'ALEMANA' o 'BULLET'."),
+        ("cuponspread", "numeric", spread.isna(), "CuponSpread debe ser un número válido."),
+        ("cuponspread", "positive", spread < 0, "CuponSpread debe ser un número positivo."),
+    ]
+
+
+def validate_contracts_frame(df, max_errors=None, first_row=2, seen=None):
+    # Valida columnas enteras con mascaras. Devuelve (es_valido, errores) donde cada error es
+    # {"row", "contract", "field", "rule", "message"}; como mucho se detallan max_errors.
+    # seen: {numero_contrato: fila} ya importados del mismo fichero (validacion por trozos),
+    # para detectar los repetidos entre trozos.
+    if max_errors is None:
+        max_errors = getattr(settings, "IRRBB_IMPORT_MAX_ERRORS", DEFAULT_MAX_ERRORS)
 
     columns_error = []
-    for col in columns_required:
+    for col in COLUMNS_REQUIRED:
         if col not in df.columns:
             columns_error.append(f"{col} ")
-    if len(columns_error) > 0:
-        errors.append("Columnas requeridas faltantes: " + ', '.join(columns_error))
-        return False, errors
-    
-    for i, row in df.iterrows():
-        num_fila = i + 2
+    if len(columns_error) > 0: # error de estructura: no se sigue validando
+        message = "Columnas requeridas faltantes: " + ', '.join(columns_error)
+        return False, [{"row": None, "contract": None, "field": None, "rule": "missing_columns", "message": message}]
 
-        try:
-            if pd.isna(row.get('numerocontrato')):
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: NumeroContrato está vacío.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: NumeroContrato está vacío.")
-        
-        try:
-            if str(row.get('activopasivo')).upper() not in ['ACTIVO', 'PASIVO']:
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: ActivoPasivo debe ser 'ACTIVO' o 'PASIVO'.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: ActivoPasivo debe ser 'ACTIVO' o 'PASIVO'.")
+    checks = _validation_checks(df, seen)
+    positions = [np.flatnonzero(mask.to_numpy()) for _, _, mask, _ in checks]
+    rule_ids = [np.full(len(pos), i) for i, pos in enumerate(positions)]
+    positions = np.concatenate(positions)
+    rule_ids = np.concatenate(rule_ids)
 
-        try:
-            nominal = float(row.get('nominal'))
-            if nominal < 0:
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: Nominal debe ser un número positivo.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: Nominal debe ser un número válido.")
+    total = len(positions)
+    order = np.lexsort((rule_ids, positions))[:max_errors] # por fila y despues por regla
 
+    num_filas = df.index.to_numpy() + first_row
+    contratos = df['numerocontrato'].astype(str).to_numpy()
+    errors = []
+    primeras = None # fila de la primera aparicion de cada numero (para los repetidos)
+    for pos, rule_id in zip(positions[order], rule_ids[order]):
+        field, rule, _, text = checks[rule_id]
+        num_fila = int(num_filas[pos])
+        if rule == "unique":
+            if primeras is None:
+                primeras = {**dict(zip(contratos[::-1].tolist(), num_filas[::-1].tolist())), **(seen or {})}
+            text = f"{text} (primera aparición en la fila {primeras[contratos[pos]]})."
+        errors.append({
+            "row": num_fila,
+            "contract": contratos[pos],
+            "field": field,
+            "rule": rule,
+            "message": f"Fila {num_fila}, {contratos[pos]}: {text}",
+        })
+
+    if total > len(errors):
+        errors.append({
+            "row": None, "contract": None, "field": None, "rule": "max_errors",
+            "message": f"... y {total - len(errors)} errores más.",
+        })
+
+    return total == 0, errors
+
+
+def iter_excel_frames(archivo, chunk_size):
+    # Lee el Excel en modo read-only de openpyxl y devuelve DataFrames de chunk_size filas.
+    # El indice de cada DataFrame es (fila de la hoja - 2), como en read_contracts_frame.
+    wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(col).lower() if col is not None else "" for col in header]
+
+        numbered = ((i, row) for i, row in enumerate(rows) if any(v is not None for v in row))
+        while True:
+            batch = list(islice(numbered, chunk_size))
+            if not batch:
+                return
+            index, values = zip(*batch)
+            yield pd.DataFrame(list(values), columns=columns, index=list(index))
+    finally:
+        wb.close()
+
+
+def iter_csv_frames(archivo, chunk_size):
+    # el lector de pandas mantiene el indice correlativo entre trozos. Si un trozo trae
+    # texto en una columna numerica se sigue desde ese punto leyendo todo como texto.
+    consumed = 0
+    try:
+        for df in pd.read_csv(archivo, chunksize=chunk_size, **_csv_options(archivo)):
+            df.columns = df.columns.str.lower()
+            consumed += len(df)
+            yield df
+        return
+    except ValueError:
+        _rewind(archivo)
+
+    reader = pd.read_csv(archivo, chunksize=chunk_size, dtype="str", skiprows=range(1, consumed + 1))
+    for df in reader:
+        df.columns = df.columns.str.lower()
+        df.index = df.index + consumed
+        yield df
+
+
+def iter_parquet_frames(archivo, chunk_size):
+    offset = 0
+    for batch in _parquet_file(archivo).iter_batches(batch_size=chunk_size):
+        df = batch.to_pandas()
+        df.columns = df.columns.str.lower()
+        df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        yield df
+
+
+def iter_contract_frames(archivo, chunk_size):
+    formato = detect_format(archivo)
+    if formato == "csv":
+        return iter_csv_frames(archivo, chunk_size)
+    if formato == "parquet":
+        return iter_parquet_frames(archivo, chunk_size)
+    return iter_excel_frames(archivo, chunk_size)
+
+
+def count_contract_rows(archivo):
+    # numero de filas de datos para mostrar el progreso (None si no se puede saber barato)
+    formato = detect_format(archivo)
+    try:
+        if formato == "parquet":
+            return _parquet_file(archivo).metadata.num_rows
+        if formato == "csv":
+            lines = 0
+            last = b"\n"
+            fh = archivo if hasattr(archivo, "read") else open(archivo, "rb")
+            try:
+                for block in iter(lambda: fh.read(1 << 20), b""):
+                    if isinstance(block, str):
+                        block = block.encode()
+                    lines += block.count(b"\n")
+                    last = block[-1:]
+            finally:
+                if fh is not archivo:
+                    fh.close()
+            return max(lines - (last == b"\n"), 0)
+        wb = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
         try:
-            start_date = pd.to_datetime(row.get('fechainicio'))
-            finish_date = pd.to_datetime(row.get('fechavencimiento'))
-            if start_date >= finish_date:
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: FechaInicio debe ser anterior a FechaVencimiento.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: Fechas no válidas.")
-        
-        try:
-            if str(row.get('tipointeres')).upper() not in ['FIJO', 'VARIABLE']:
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: TipoInteres debe ser 'FIJO' o 'VARIABLE'.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: TipoInteres debe ser 'FIJO' o 'VARIABLE'.")
-        
-        try:
-            if str(row.get('amortizacion')).upper() not in ['FRANCESA', 'ALEMANA', 'BULLET']:
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: Amortizacion debe ser 'FRANCESA', 'ALEMANA' o 'BULLET'.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: Amortizacion debe ser 'FRANCESA', 'ALEMANA' o 'BULLET'.")
-        
-        try:
-            if float(row.get('cuponspread')) < 0:
-                errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: CuponSpread debe ser un número positivo.")
-        except (ValueError, TypeError):
-            errors.append(f"Fila {num_fila}, {row.get('numerocontrato')}: CuponSpread debe ser un número válido.")
-    
-    return len(errors) == 0, errors
\ No newline at end of file
+            max_row = wb.active.max_row
+        finally:
+            wb.close()
+        return max_row - 1 if max_row else None
+    except Exception:
+        return None
+    finally:
+        _rewind(archivo)
+
+
+def import_contracts_streaming(archivo, banco, curva="EURIBOR", chunk_size=None, progress=None, max_errors=None, mode="upsert"):
+    # Valida e importa el fichero (xlsx, csv o parquet) por trozos sin cargarlo entero.
+    # mode="upsert" da de alta los nuevos y actualiza los que cambian; mode="sync" ademas
+    # borra los contratos del banco que no vienen en el fichero. Si un trozo tiene errores
+    # se lanza ContractImportError y se deshace todo. progress(filas, trozo) se llama al
+    # terminar cada trozo. Devuelve el informe de new_import_report().
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"Modo de importación no válido: {mode}")
+    if chunk_size is None:
+        chunk_size = getattr(settings, "IRRBB_IMPORT_CHUNK_SIZE", DEFAULT_CHUNK_SIZE)
+
+    report = new_import_report()
+    # {numero_contrato: fila} de todo lo leido: los repetidos entre trozos tambien son error
+    numeros_vistos = {}
+    with transaction.atomic():
+        for n_chunk, df in enumerate(iter_contract_frames(archivo, chunk_size), start=1):
+            es_valido, errores = validate_contracts_frame(df, max_errors, seen=numeros_vistos)
+            if not es_valido:
+                raise ContractImportError(errores)
+
+            load_contracts_frame(df, banco, curva, report=report)
+            numeros_vistos.update(zip(df['numerocontrato'].astype(str).tolist(), (df.index + 2).tolist()))
+            if progress is not None:
+                progress(report["rows"], n_chunk)
+
+        if mode == "sync":
+            remove_missing_contracts(banco, numeros_vistos, report=report)
+
+    return report
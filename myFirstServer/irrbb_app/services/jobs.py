@@ -0,0 +1,228 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from ..models import Trabajo
+from . import contract_pricing, import_excel
+
+# Cola de trabajos en base de datos: la vista crea el Trabajo y el worker
+# (manage.py irrbb_worker) lo reclama, importa el fichero y valora el balance.
+
+JOB_CACHE = "irrbb_jobs"
+# parte del progreso (en %) que corresponde a la importacion en un trabajo IMPORTAR
+IMPORT_SHARE = 50.0
+DEFAULT_STALE_SECONDS = 900
+DEFAULT_PENDING_WARNING_SECONDS = 30
+
+
+def _cache():
+    return caches[JOB_CACHE]
+
+
+def _progress_key(job_id):
+    return f"irrbb:trabajo:{job_id}"
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_import(archivo, banco, uploaded_by=None, modo="upsert"):
+    # guarda el fichero subido en MEDIA_ROOT y deja el trabajo pendiente
+    trabajo = Trabajo(banco=banco, uploaded_by=uploaded_by, tipo=Trabajo.IMPORTAR, modo=modo)
+    trabajo.archivo.save(os.path.basename(archivo.name), archivo, save=False)
+    trabajo.save()
+    return trabajo
+
+
+def enqueue_pricing(banco, uploaded_by=None):
+    return Trabajo.objects.create(banco=banco, uploaded_by=uploaded_by, tipo=Trabajo.VALORAR)
+
+
+def claim_job(trabajo, worker=None):
+    # el UPDATE condicionado al estado hace que dos workers no se queden con el mismo trabajo
+    claimed = Trabajo.objects.filter(pk=trabajo.pk, estado=Trabajo.PENDIENTE).update(
+        estado=Trabajo.EN_CURSO, worker=worker or worker_name(), started_at=timezone.now()
+    )
+    if claimed:
+        trabajo.refresh_from_db()
+    return bool(claimed)
+
+
+def claim_next_job(worker=None):
+    # el trabajo pendiente mas antiguo, o None si la cola esta vacia
+    pendientes = Trabajo.objects.filter(estado=Trabajo.PENDIENTE).order_by("created_at", "id")
+    for trabajo in pendientes[:10]:
+        if claim_job(trabajo, worker):
+            return trabajo
+    return None
+
+
+class JobProgress:
+    # Etapa, porcentaje y tiempos del trabajo en curso. Se guardan en la cache compartida
+    # porque la importacion y la valoracion corren dentro de transacciones y lo que se
+    # escriba en la fila del Trabajo no se veria hasta el final.
+    def __init__(self, trabajo):
+        self.trabajo = trabajo
+        self.stage = ""
+        self.percent = 0.0
+        self.tiempos = {}
+        self._started = time.monotonic()
+        self._stage_started = None
+
+    def start_stage(self, stage, percent):
+        self.close_stage()
+        self.stage = stage
+        self._stage_started = time.monotonic()
+        self.update(percent)
+
+    def close_stage(self):
+        if self._stage_started is not None:
+            self.tiempos[self.stage] = round(time.monotonic() - self._stage_started, 3)
+        self._stage_started = None
+
+    def update(self, percent):
+        self.percent = min(max(float(percent), self.percent), 100.0)
+        _cache().set(
+            _progress_key(self.trabajo.pk),
+            {"etapa": self.stage, "progreso": round(self.percent, 1), "tiempos": self.tiempos, "latido": time.time()},
+            timeout=None,
+        )
+
+    def elapsed(self):
+        return round(time.monotonic() - self._started, 3)
+
+
+def _summary(report):
+    # el informe guardado lleva los recuentos, no las listas de numeros de contrato
+    return {key: len(value) if isinstance(value, list) else value for key, value in report.items()}
+
+
+def _run_import(trabajo, progress):
+    progress.start_stage("importacion", 0)
+    with trabajo.archivo.open("rb") as archivo:
+        total = import_excel.count_contract_rows(archivo)
+
+        def on_chunk(rows, n_chunk):
+            if total:
+                progress.update(IMPORT_SHARE * min(rows / total, 1.0))
+
+        report = import_excel.import_contracts_streaming(archivo, trabajo.banco, mode=trabajo.modo, progress=on_chunk)
+    trabajo.informe = {**trabajo.informe, **_summary(report)}
+    return report
+
+
+def run_job(trabajo):
+    # Ejecuta un trabajo ya reclamado (EN_CURSO). Los errores quedan en el propio Trabajo.
+    # La importacion y la valoracion van cada una en su transaccion: SQLite solo admite un
+    # escritor y una transaccion que durase todo el trabajo bloquearia las subidas y el resto
+    # de escrituras de la web. Si la valoracion falla despues de importar, los contratos se
+    # quedan importados y se deja en cola un trabajo VALORAR que vuelve a valorar el balance.
+    progress = JobProgress(trabajo)
+    changes = None
+    try:
+        share = 0.0
+        if trabajo.tipo == Trabajo.IMPORTAR:
+            changes = _run_import(trabajo, progress)
+            share = IMPORT_SHARE
+            if trabajo.archivo:
+                trabajo.archivo.delete(save=False)
+
+        progress.start_stage("valoracion", share)
+        salida = contract_pricing.run_balance_pricing(
+            trabajo.banco,
+            uploaded_by=trabajo.uploaded_by,
+            changes=changes,
+            progress=lambda done, total: progress.update(share + (100 - share) * done / max(total, 1)),
+        )
+        _finish(trabajo, progress, Trabajo.COMPLETADO, resultado=salida["resultado"] if salida else None)
+    except import_excel.ContractImportError as e:
+        trabajo.informe = {**trabajo.informe, "errores": e.errors}
+        _finish(trabajo, progress, Trabajo.ERROR, error="Hay errores en el fichero - Importación cancelada")
+    except Exception as e:
+        error = str(e) or e.__class__.__name__
+        if changes is not None:
+            reintento = enqueue_pricing(trabajo.banco, uploaded_by=trabajo.uploaded_by)
+            trabajo.informe = {**trabajo.informe, "reintento": reintento.pk}
+            error = f"{error} - Contratos importados, valoración pendiente en el trabajo #{reintento.pk}"
+        _finish(trabajo, progress, Trabajo.ERROR, error=error)
+    return trabajo
+
+
+def _finish(trabajo, progress, estado, error="", resultado=None):
+    progress.close_stage()
+    trabajo.estado = estado
+    trabajo.etapa = progress.stage
+    trabajo.progreso = 100.0 if estado == Trabajo.COMPLETADO else progress.percent
+    trabajo.error = error
+    trabajo.resultado = resultado
+    trabajo.tiempos = {**progress.tiempos, "total": progress.elapsed()}
+    trabajo.finished_at = timezone.now()
+    trabajo.save()
+    _cache().delete(_progress_key(trabajo.pk))
+
+
+def interrupt_job(trabajo, error="Trabajo interrumpido"):
+    # el worker se ha parado (Ctrl+C) con el trabajo a medias
+    Trabajo.objects.filter(pk=trabajo.pk, estado=Trabajo.EN_CURSO).update(
+        estado=Trabajo.ERROR, error=error, finished_at=timezone.now()
+    )
+    _cache().delete(_progress_key(trabajo.pk))
+
+
+def fail_stale_jobs(max_age=None):
+    # trabajos EN_CURSO cuyo worker ya no da señales de vida (latido en la cache)
+    if max_age is None:
+        max_age = getattr(settings, "IRRBB_JOB_STALE_SECONDS", DEFAULT_STALE_SECONDS)
+    now = time.time()
+    failed = 0
+    for trabajo in Trabajo.objects.filter(estado=Trabajo.EN_CURSO):
+        live = _cache().get(_progress_key(trabajo.pk))
+        latido = live["latido"] if live else (trabajo.started_at or trabajo.created_at).timestamp()
+        if now - latido > max_age:
+            interrupt_job(trabajo, error="El worker dejó de responder")
+            failed += 1
+    return failed
+
+
+def job_status(trabajo):
+    # estado para el endpoint JSON: lo guardado en la fila + el progreso en vivo si esta en curso
+    live = _cache().get(_progress_key(trabajo.pk)) if trabajo.estado == Trabajo.EN_CURSO else None
+    etapa = live["etapa"] if live else trabajo.etapa
+    progreso = live["progreso"] if live else trabajo.progreso
+    tiempos = live["tiempos"] if live else trabajo.tiempos
+
+    now = timezone.now()
+    espera = ((trabajo.started_at or now) - trabajo.created_at).total_seconds()
+    duracion = ((trabajo.finished_at or now) - trabajo.started_at).total_seconds() if trabajo.started_at else None
+
+    return {
+        "id": trabajo.pk,
+        "tipo": trabajo.tipo,
+        "estado": trabajo.estado,
+        "etapa": etapa,
+        "progreso": progreso,
+        "informe": trabajo.informe,
+        "error": trabajo.error,
+        "resultado": trabajo.resultado_id,
+        "created_at": trabajo.created_at.isoformat(),
+        "started_at": trabajo.started_at.isoformat() if trabajo.started_at else None,
+        "finished_at": trabajo.finished_at.isoformat() if trabajo.finished_at else None,
+        "espera": round(espera, 3),
+        "duracion": round(duracion, 3) if duracion is not None else None,
+        "tiempos": tiempos,
+        "sin_worker": waiting_for_worker(trabajo, now),
+    }
+
+
+def waiting_for_worker(trabajo, now=None):
+    # el trabajo sigue pendiente mas de IRRBB_JOB_PENDING_WARNING_SECONDS: no hay ningun
+    # worker (manage.py irrbb_worker) atendiendo la cola
+    if trabajo.estado != Trabajo.PENDIENTE:
+        return False
+    limit = getattr(settings, "IRRBB_JOB_PENDING_WARNING_SECONDS", DEFAULT_PENDING_WARNING_SECONDS)
+    return ((now or timezone.now()) - trabajo.created_at).total_seconds() > limit
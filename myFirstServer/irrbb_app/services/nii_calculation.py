@@ -1,6 +1,9 @@
 import numpy as np
 import pandas as pd
 
+from .curve import cashflow_days, curve_grid
+from .eve_calculation import grouped_product
+
 SCENARIO_COLUMNS = {
     "nii_base": "rate_base_curve",
     "nii_parallel_up": "rate_parallel_up_curve",
@@ -8,24 +11,60 @@ SCENARIO_COLUMNS = {
 }
 
 
-def calculate_nii(cashflows_df, curve_df, horizon_years = 1.0):
-    df = cashflows_df[cashflows_df["year"] <= horizon_years].copy()
-    results = {}
-    if len(df) == 0: # no hay flujos
-        for name in SCENARIO_COLUMNS:
-            results[name] = 0.0
-        return results
+def repricing_notional(cashflows_df):
+    # solo intereses variables: saldo * año de devengo que se reprecia. Las tablas ya
+    # agregadas por dia (CashflowProfile) lo traen calculado.
+    if "repricing_notional" in cashflows_df:
+        return np.asarray(cashflows_df["repricing_notional"], dtype=np.float64)
+    return (
+        np.asarray(cashflows_df["rest_start"], dtype=np.float64)
+        * np.asarray(cashflows_df["year_fraction"], dtype=np.float64)
+        * np.asarray(cashflows_df["is_floating"], dtype=np.float64)
+    )
+
+
+def calculate_nii_by_group(cashflows_df, curve_df, groups, n_groups, horizon_years = 1.0, scenario_columns = None):
+    # NII de cada grupo en una sola pasada: matriz grupos x escenarios
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
+
+    in_horizon = np.asarray(cashflows_df["year"], dtype=np.float64) <= horizon_years
+    if not in_horizon.any(): # no hay flujos
+        return np.zeros((n_groups, len(scenario_columns)))
+
+    groups = np.asarray(groups, dtype=np.int64)[in_horizon]
+    days = cashflow_days(cashflows_df)[in_horizon]
+    interest = np.bincount(groups, weights=np.asarray(cashflows_df["interest"], dtype=np.float64)[in_horizon], minlength=n_groups)
+
+    notional = repricing_notional(cashflows_df)[in_horizon]
+
+    max_day = int(days.max())
+    rates = curve_grid(curve_df).rate_table(["rate_base_curve", *scenario_columns.values()], max_day)
+    shift = rates[:, 1:] - rates[:, :1] # tipo escenario - tipo base
+    repricing = grouped_product(notional, days, groups, n_groups, shift)
+
+    return interest[:, None] + repricing
+
+
+def calculate_nii(cashflows_df, curve_df, horizon_years = 1.0, scenario_columns = None):
+    # cashflows_df puede ser un DataFrame o la tabla columnar (dict de arrays)
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
 
-    maturities = curve_df["maturity_years"].to_numpy()
-    base_rate = np.interp(df["year"], maturities, curve_df["rate_base_curve"]) / 10000
+    groups = np.zeros(len(cashflows_df["year"]), dtype=np.int64)
+    nii = calculate_nii_by_group(cashflows_df, curve_df, groups, 1, horizon_years, scenario_columns)[0]
 
-    for scenario, col in SCENARIO_COLUMNS.items():
-        scenario_rate = np.interp(df["year"], maturities, curve_df[col]) / 10000
-        r = scenario_rate - base_rate
+    return {scenario: float(value) for scenario, value in zip(scenario_columns, nii)}
 
-        # solo intereses variables
-        repricing = df["rest_start"] * r * df["year_fraction"] * df["is_floating"]
-        total_interest = df["interest"] + repricing
-        results[scenario] = float(total_interest.sum())
 
-    return results
+def calculate_nii_sweep(cashflows_df, shocks_bp, shape=None, horizon_years = 1.0):
+    # NII con la curva base desplazada shocks_bp[k] * shape[dia] pb. El NII es lineal en el
+    # desplazamiento, asi que basta con una suma sobre los flujos para todos los shocks.
+    # shape: shock por pb de cada dia (None = paralelo)
+    shocks_bp = np.asarray(shocks_bp, dtype=np.float64)
+    in_horizon = np.asarray(cashflows_df["year"], dtype=np.float64) <= horizon_years
+    interest = np.asarray(cashflows_df["interest"], dtype=np.float64)[in_horizon].sum()
+    notional = repricing_notional(cashflows_df)[in_horizon]
+    if shape is not None:
+        notional = notional * np.asarray(shape)[cashflow_days(cashflows_df)[in_horizon]]
+    return interest + notional.sum() / 10000 * shocks_bp
@@ -0,0 +1,75 @@
+import numpy as np
+
+from .curve import curve_grid, curves_by_key
+from .nii_calculation import SCENARIO_COLUMNS
+
+# Proyeccion mensual del NII por escenario sobre los flujos agregados por dia de la cartera
+# (CashflowProfile). Cada mes (30 dias, t = dia / 360) suma:
+#   - los intereses contractuales que se pagan en el mes,
+#   - el saldo que se reprecia en el mes * (tipo escenario - tipo base), como calculate_nii,
+#   - con balance constante, los intereses del principal ya vencido, que se renueva al
+#     forward del escenario de cada mes: saldo renovado * (DF(inicio) / DF(fin) - 1).
+# El saldo renovado es la suma acumulada del principal vencido en los meses anteriores
+# (diferencias por mes + cumsum), asi que la renovacion no genera contratos ni flujos nuevos.
+# El dia 0 del perfil no entra: sin IRRBB_FORWARD_ONLY_CASHFLOWS alli se acumulan todos los
+# flujos ya pagados (la fecha se recorta a la de valoracion), que no son NII futuro ni
+# principal por renovar; con flujos forward_only el dia 0 esta vacio. Con balance constante
+# desactivado, el total a 1 año coincide con el NII de calculate_nii sobre flujos forward_only.
+
+DEFAULT_HORIZONS = (1, 3, 5)
+MONTH_DAYS = 30
+
+
+def _monthly(values, n_months):
+    # valores por dia (dias x ...) -> suma por mes (meses x ...) de los dias 1..n_months * 30;
+    # el dia 0 (flujos pasados recortados a la fecha de valoracion) se descarta
+    width = n_months * MONTH_DAYS + 1
+    values = values[:width]
+    if len(values) < width:
+        values = np.pad(values, [(0, width - len(values))] + [(0, 0)] * (values.ndim - 1))
+    return values[1:].reshape(n_months, MONTH_DAYS, *values.shape[1:]).sum(axis=1)
+
+
+def project_table(table, curve_df, n_months, scenario_columns=None, constant_balance=True):
+    # tabla por dia de una curva (CashflowProfile.table) -> NII de cada mes: meses x escenarios
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
+    columns = list(scenario_columns.values())
+    max_day = n_months * MONTH_DAYS
+    grid = curve_grid(curve_df)
+
+    interest = _monthly(np.asarray(table["interest"], dtype=np.float64), n_months)
+    nii = np.repeat(interest[:, None], len(columns), axis=1)
+
+    notional = np.asarray(table["repricing_notional"], dtype=np.float64)[: max_day + 1]
+    if len(notional):
+        rates = grid.rate_table(["rate_base_curve", *columns], len(notional) - 1)
+        nii += _monthly(notional[:, None] * (rates[:, 1:] - rates[:, :1]), n_months)
+
+    if constant_balance:
+        principal = _monthly(np.asarray(table["cashflow"], dtype=np.float64) - np.asarray(table["interest"], dtype=np.float64), n_months)
+        # el principal que vence en el mes m se renueva desde el mes m + 1
+        rolled = np.concatenate([[0.0], np.cumsum(principal)[:-1]])
+        discount = grid.discount_factors(columns, max_day)[::MONTH_DAYS]
+        nii += rolled[:, None] * (discount[:-1] / discount[1:] - 1)
+    return nii
+
+
+def project_nii(profile, curves, horizons=DEFAULT_HORIZONS, scenario_columns=None, constant_balance=True):
+    # -> {"months": n, "monthly": {escenario: [NII de cada mes]}, "totals": {años: {escenario: NII}}},
+    # sumando las tablas de todas las curvas del perfil. El horizonte mas largo fija los meses.
+    if scenario_columns is None:
+        scenario_columns = SCENARIO_COLUMNS
+    n_months = int(round(max(horizons) * 12))
+    frames = curves_by_key(curves)
+    nii = np.zeros((n_months, len(scenario_columns)))
+    for key in profile.tables:
+        nii += project_table(profile.table(key), frames[key], n_months, scenario_columns, constant_balance)
+    return {
+        "months": n_months,
+        "constant_balance": constant_balance,
+        "monthly": {name: nii[:, i].tolist() for i, name in enumerate(scenario_columns)},
+        "totals": {
+            str(years): dict(zip(scenario_columns, nii[: int(round(years * 12))].sum(axis=0).tolist())) for years in horizons
+        },
+    }
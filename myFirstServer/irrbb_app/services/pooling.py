@@ -0,0 +1,101 @@
+import numpy as np
+
+# Agrupacion de contratos homogeneos en pools representativos: los contratos con el mismo
+# producto, activo_pasivo, tipo de interes, amortizacion, frecuencia de cupon y curva, el
+# mismo mes de vencimiento (en tramos de maturity_months meses) y el mismo tramo de tipo
+# (rate_band_bp pb de cupon_spread) se valoran como un unico contrato con el nominal total
+# y las fechas y el tipo medios ponderados por nominal. Los flujos son lineales en el
+# nominal, asi que el error solo viene de promediar fechas y tipos dentro del pool; con
+# start_months tambien se separan por tramo de fecha de inicio, que en los prestamos que
+# amortizan fija el saldo vivo.
+
+DEFAULT_MATURITY_MONTHS = 1
+DEFAULT_RATE_BAND_BP = 25
+
+# campos de la cartera que se copian del primer contrato de cada pool (iguales en todo el pool)
+KEY_FIELDS = ("producto", "activo_pasivo", "is_floating", "amortizacion", "frecuencia_cupon", "curva_asociada")
+
+
+class PoolBuilder:
+    # Recorre la cartera por trozos (iter_portfolio) y guarda solo sumas por pool, asi que la
+    # memoria depende del numero de pools y no del de contratos.
+    def __init__(self, maturity_months=DEFAULT_MATURITY_MONTHS, rate_band_bp=DEFAULT_RATE_BAND_BP, start_months=None):
+        if maturity_months < 1 or rate_band_bp <= 0 or (start_months is not None and start_months < 1):
+            raise ValueError("La granularidad de los pools debe ser positiva")
+        self.maturity_months = int(maturity_months)
+        self.rate_band_bp = float(rate_band_bp)
+        self.start_months = int(start_months) if start_months is not None else None
+        self.pools = {}
+        self.keys = []
+        # por pool: contratos, nominal y sumas ponderadas por nominal (y sin ponderar, para
+        # los pools de nominal 0) de inicio, vencimiento y tipo
+        self.sums = np.zeros((0, 8))
+
+    @property
+    def n_pools(self):
+        return len(self.keys)
+
+    def add(self, portfolio):
+        maturity = portfolio["fecha_vencimiento"].astype("datetime64[M]").astype(np.int64) // self.maturity_months
+        band = np.floor(portfolio["cupon_spread"] * 10000 / self.rate_band_bp).astype(np.int64)
+        if self.start_months is None:
+            start = np.zeros(len(band), dtype=np.int64)
+        else:
+            start = portfolio["fecha_inicio"].astype("datetime64[M]").astype(np.int64) // self.start_months
+        keys = zip(*(portfolio[field].tolist() for field in KEY_FIELDS), maturity.tolist(), band.tolist(), start.tolist())
+        codes = np.fromiter((self._code(key) for key in keys), dtype=np.int64, count=len(portfolio["id"]))
+        if self.n_pools > len(self.sums):
+            self.sums = np.vstack([self.sums, np.zeros((self.n_pools - len(self.sums), self.sums.shape[1]))])
+
+        nominal = portfolio["nominal"]
+        inicio = portfolio["fecha_inicio"].astype(np.int64).astype(np.float64)
+        fin = portfolio["fecha_vencimiento"].astype(np.int64).astype(np.float64)
+        rate = portfolio["cupon_spread"]
+        values = np.column_stack([
+            np.ones(len(codes)), nominal, nominal * inicio, nominal * fin, nominal * rate, inicio, fin, rate,
+        ])
+        for j in range(values.shape[1]):
+            self.sums[:, j] += np.bincount(codes, weights=values[:, j], minlength=self.n_pools)
+
+    def _code(self, key):
+        code = self.pools.get(key)
+        if code is None:
+            code = self.pools[key] = len(self.keys)
+            self.keys.append(key)
+        return code
+
+    def portfolio(self):
+        # pools -> cartera con el formato de portfolio_from_rows y una columna "count" con
+        # los contratos de cada pool
+        count, nominal = self.sums[:, 0], self.sums[:, 1]
+        weighted = nominal != 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inicio, fin, rate = (
+                np.where(weighted, self.sums[:, 2 + i] / nominal, self.sums[:, 5 + i] / count) for i in range(3)
+            )
+        inicio = np.rint(inicio).astype(np.int64)
+        fin = np.maximum(np.rint(fin).astype(np.int64), inicio + 1)
+        fields = list(zip(*self.keys)) if self.keys else [()] * (len(KEY_FIELDS) + 3)
+        columns = dict(zip(KEY_FIELDS, fields))
+        return {
+            "id": np.arange(self.n_pools, dtype=np.int64),
+            "numero_contrato": np.asarray([f"POOL-{i}" for i in range(self.n_pools)], dtype=object),
+            "producto": np.asarray(columns["producto"], dtype=object),
+            "activo_pasivo": np.asarray(columns["activo_pasivo"], dtype=object),
+            "nominal": nominal.copy(),
+            "fecha_inicio": inicio.astype("datetime64[D]"),
+            "fecha_vencimiento": fin.astype("datetime64[D]"),
+            "is_floating": np.asarray(columns["is_floating"], dtype=bool),
+            "amortizacion": np.asarray(columns["amortizacion"], dtype=np.int8),
+            "cupon_spread": rate,
+            "frecuencia_cupon": np.asarray(columns["frecuencia_cupon"], dtype=np.int64),
+            "curva_asociada": np.asarray(columns["curva_asociada"], dtype=object),
+            "count": count.astype(np.int64),
+        }
+
+
+def pool_portfolio(chunks, maturity_months=DEFAULT_MATURITY_MONTHS, rate_band_bp=DEFAULT_RATE_BAND_BP, start_months=None):
+    builder = PoolBuilder(maturity_months, rate_band_bp, start_months)
+    for chunk in chunks:
+        builder.add(chunk)
+    return builder.portfolio()
@@ -0,0 +1,75 @@
+from itertools import islice
+
+import numpy as np
+
+# codigos numericos de amortizacion para trabajar con arrays
+AMORT_FRANCESA = 0
+AMORT_ALEMANA = 1
+AMORT_BULLET = 2
+
+AMORTIZATION_CODES = {
+    "FRANCESA": AMORT_FRANCESA,
+    "ALEMANA": AMORT_ALEMANA,
+    "BULLET": AMORT_BULLET,
+}
+
+PORTFOLIO_FIELDS = (
+    "id",
+    "numero_contrato",
+    "producto",
+    "activo_pasivo",
+    "nominal",
+    "fecha_inicio",
+    "fecha_vencimiento",
+    "tipo_interes",
+    "tipo_amortizacion",
+    "cupon_spread",
+    "frecuencia_cupon",
+    "curva_asociada",
+)
+
+
+def portfolio_from_rows(rows):
+    # rows: tuplas en el orden de PORTFOLIO_FIELDS (values_list)
+    columns = list(zip(*rows)) if rows else [()] * len(PORTFOLIO_FIELDS)
+    data = dict(zip(PORTFOLIO_FIELDS, columns))
+
+    amortizacion = [AMORTIZATION_CODES.get(str(a).upper(), AMORT_BULLET) for a in data["tipo_amortizacion"]]
+
+    return {
+        "id": np.asarray(data["id"], dtype=np.int64),
+        "numero_contrato": np.asarray(data["numero_contrato"], dtype=object),
+        "producto": np.asarray(data["producto"], dtype=object),
+        "activo_pasivo": np.asarray(data["activo_pasivo"], dtype=object),
+        "nominal": np.asarray(data["nominal"], dtype=np.float64),
+        "fecha_inicio": np.asarray(data["fecha_inicio"], dtype="datetime64[D]"),
+        "fecha_vencimiento": np.asarray(data["fecha_vencimiento"], dtype="datetime64[D]"),
+        "is_floating": np.asarray([t == "VARIABLE" for t in data["tipo_interes"]], dtype=bool),
+        "amortizacion": np.asarray(amortizacion, dtype=np.int8),
+        "cupon_spread": np.asarray(data["cupon_spread"], dtype=np.float64),
+        "frecuencia_cupon": np.asarray(data["frecuencia_cupon"], dtype=np.int64),
+        "curva_asociada": np.asarray(data["curva_asociada"], dtype=object),
+    }
+
+
+def load_portfolio(contratos):
+    # contratos: queryset de Contrato -> dict de arrays numpy (una posicion por contrato)
+    rows = list(contratos.order_by("id").values_list(*PORTFOLIO_FIELDS))
+    return portfolio_from_rows(rows)
+
+
+def iter_portfolio(contratos, chunk_size):
+    # recorre la cartera por trozos de chunk_size contratos sin cargarla entera
+    rows = contratos.order_by("id").values_list(*PORTFOLIO_FIELDS).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield portfolio_from_rows(chunk)
+
+
+def portfolio_size(portfolio):
+    # contratos de la cartera; una cartera agrupada (pooling) trae los de cada pool en "count"
+    if "count" in portfolio:
+        return int(portfolio["count"].sum())
+    return len(portfolio["id"])
@@ -0,0 +1,256 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .buckets import GAP_FIELDS, N_BUCKETS, calculate_eve_krd_bucketed, calculate_nii_bucketed, gap_by_group, join_gap, split_gap
+from .cashflow_profile import CashflowProfile, day_profile
+from .cashflows import build_portfolio_cashflows
+from .curve import curve_groups, curve_key
+from .eve_calculation import KEY_RATE_TENORS, calculate_eve_krd_by_group
+from .nii_calculation import calculate_nii_by_group
+from .portfolio import portfolio_size
+from .scenarios import DEFAULT_SCENARIOS
+
+# Este modulo no importa modelos de Django: los procesos del pool solo reciben arrays.
+
+DEFAULT_CHUNK_SIZE = 50_000
+
+
+def take_contracts(portfolio, rows):
+    # subconjunto de la cartera (slice o array de posiciones)
+    return {field: values[rows] for field, values in portfolio.items()}
+
+
+def chunk_slices(n_contracts, chunk_size):
+    chunk_size = max(int(chunk_size), 1)
+    return [slice(start, min(start + chunk_size, n_contracts)) for start in range(0, n_contracts, chunk_size)]
+
+
+def iter_chunks(portfolio, chunk_size=DEFAULT_CHUNK_SIZE):
+    for rows in chunk_slices(len(portfolio["id"]), chunk_size):
+        yield take_contracts(portfolio, rows)
+
+
+class PortfolioAccumulator:
+    # Sumas acumuladas por (activo_pasivo, producto): numero de contratos, nominal y
+    # EVE/NII por escenario. Cada trozo de cartera se suma y se descarta, asi que la
+    # memoria depende del numero de productos y no del de contratos.
+    # scenarios: ScenarioSet con los escenarios EVE / NII que se acumulan.
+    # profile: flujos de toda la cartera agregados por dia y curva (CashflowProfile).
+    # gap: flujos y saldo que se reprecia por grupo y banda temporal (buckets.GAP_FIELDS).
+    # krd: PV01 por grupo en cada tipo clave de key_rate_tenors.
+    def __init__(self, scenarios=None, key_rate_tenors=KEY_RATE_TENORS):
+        self.scenarios = scenarios if scenarios is not None else DEFAULT_SCENARIOS
+        self.key_rate_tenors = tuple(key_rate_tenors)
+        self.profile = CashflowProfile()
+        self.groups = {}
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.nominals = np.zeros(0)
+        self.eve = np.zeros((0, len(self.scenarios.eve)))
+        self.nii = np.zeros((0, len(self.scenarios.nii)))
+        self.gap = np.zeros((0, len(GAP_FIELDS) * N_BUCKETS))
+        self.krd = np.zeros((0, len(self.key_rate_tenors)))
+
+    @property
+    def n_groups(self):
+        return len(self.groups)
+
+    def group_codes(self, portfolio):
+        # codigo de grupo de cada contrato; los grupos nuevos se añaden en orden de aparicion
+        keys = zip(portfolio["activo_pasivo"].tolist(), portfolio["producto"].tolist())
+        codes = np.fromiter((self.groups.setdefault(key, len(self.groups)) for key in keys), dtype=np.int64, count=len(portfolio["producto"]))
+        self._grow()
+        return codes
+
+    def _grow(self):
+        extra = self.n_groups - len(self.counts)
+        if extra > 0:
+            self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+            self.nominals = np.concatenate([self.nominals, np.zeros(extra)])
+            self.eve = np.vstack([self.eve, np.zeros((extra, self.eve.shape[1]))])
+            self.nii = np.vstack([self.nii, np.zeros((extra, self.nii.shape[1]))])
+            self.gap = np.vstack([self.gap, np.zeros((extra, self.gap.shape[1]))])
+            self.krd = np.vstack([self.krd, np.zeros((extra, self.krd.shape[1]))])
+
+    def add(self, portfolio, codes, eve, nii, sign=1, flows=None):
+        # eve / nii pueden tener menos filas si se calcularon antes de aparecer grupos nuevos.
+        # sign=-1 resta los contratos (recalculo incremental).
+        # flows: {"profile", "gap", "krd"} de price_chunk
+        # en una cartera agrupada cada pool cuenta sus contratos
+        counts = portfolio.get("count")
+        if counts is None:
+            self.counts += sign * np.bincount(codes, minlength=self.n_groups)
+        else:
+            self.counts += sign * np.bincount(codes, weights=counts, minlength=self.n_groups).astype(np.int64)
+        self.nominals += sign * np.bincount(codes, weights=portfolio["nominal"], minlength=self.n_groups)
+        self.eve[: len(eve)] += sign * eve
+        self.nii[: len(nii)] += sign * nii
+        if flows is not None:
+            self.profile.add(flows["profile"], sign)
+            self.gap[: len(flows["gap"])] += sign * flows["gap"]
+            self.krd[: len(flows["krd"])] += sign * flows["krd"]
+
+    def add_contracts(self, portfolio, eve, nii, sign=1, flows=None):
+        # eve / nii (y el gap y krd de flows) con una fila por contrato: se agregan por grupo antes de sumar
+        codes = self.group_codes(portfolio)
+        if flows is not None:
+            flows = {
+                **flows,
+                "gap": group_sum(flows["gap"], codes, self.n_groups),
+                "krd": group_sum(flows["krd"], codes, self.n_groups),
+            }
+        self.add(portfolio, codes, group_sum(eve, codes, self.n_groups), group_sum(nii, codes, self.n_groups), sign, flows)
+
+    @classmethod
+    def from_breakdown(cls, activos, pasivos, scenarios=None, key_rate_tenors=KEY_RATE_TENORS):
+        # acumulador a partir de un desglose guardado (ResultadoBalance.metadata)
+        accumulator = cls(scenarios, key_rate_tenors)
+        for activo_pasivo, productos in (("ACTIVO", activos), ("PASIVO", pasivos)):
+            for producto, datos in productos.items():
+                g = accumulator.groups.setdefault((activo_pasivo, producto), accumulator.n_groups)
+                accumulator._grow()
+                scenario = datos.get("scenario", {})
+                accumulator.counts[g] = datos.get("count", 0)
+                accumulator.nominals[g] = datos.get("nominal", 0)
+                accumulator.eve[g] = [scenario.get(key, 0) for key in accumulator.scenarios.eve]
+                accumulator.nii[g] = [scenario.get(key, 0) for key in accumulator.scenarios.nii]
+                accumulator.gap[g] = join_gap(datos.get("gap", {}))
+                krd = datos.get("krd", {})
+                accumulator.krd[g] = [krd.get(tenor, 0) for tenor in accumulator.key_rate_tenors]
+        return accumulator
+
+    def breakdown(self):
+        # -> (activos, pasivos) con el formato {producto: {"count", "nominal", "scenario"}}.
+        # Los productos que se han quedado sin contratos no aparecen.
+        activos = {}
+        pasivos = {}
+        for (activo_pasivo, producto), g in self.groups.items():
+            if self.counts[g] <= 0:
+                continue
+            dict_obj = activos if activo_pasivo == "ACTIVO" else pasivos
+            scenario = dict(zip(self.scenarios.eve, self.eve[g].tolist()))
+            scenario.update(zip(self.scenarios.nii, self.nii[g].tolist()))
+            dict_obj[producto] = {
+                "count": int(self.counts[g]),
+                "nominal": float(self.nominals[g]),
+                "scenario": scenario,
+                "gap": split_gap(self.gap[g]),
+                "krd": dict(zip(self.key_rate_tenors, self.krd[g].tolist())),
+            }
+        return activos, pasivos
+
+
+def group_sum(values, codes, n_groups):
+    # suma las filas de values (contratos x escenarios) por codigo de grupo
+    return np.column_stack([np.bincount(codes, weights=values[:, j], minlength=n_groups) for j in range(values.shape[1])])
+
+
+def _iter_cashflows(portfolio, curve_df, valuation_date, forward_only=False):
+    # (posiciones, curva, flujos) de cada subconjunto de contratos con la misma curva
+    for rows, curve in curve_groups(curve_df, portfolio):
+        contracts = portfolio if isinstance(rows, slice) else take_contracts(portfolio, rows)
+        yield rows, curve, build_portfolio_cashflows(contracts, curve, valuation_date, forward_only=forward_only)
+
+
+def price_chunk(portfolio, group_of_contract, n_groups, curve_df, valuation_date, forward_only=False, scenarios=None, bucketed=False, key_rate_tenors=KEY_RATE_TENORS):
+    # flujos de un trozo de cartera -> sumas parciales de EVE/NII por grupo y agregados de los
+    # flujos ({"profile": {curve_key: campos x dias}, "gap": grupos x (campos * bandas),
+    # "krd": grupos x tipos clave}). curve_df puede ser un CurveSet: cada subconjunto de
+    # contratos se valora contra su propia curva. Con escenarios de usuario las curvas ya
+    # deben traer sus columnas (ScenarioSet.apply). Con bucketed los flujos se valoran en el
+    # punto medio de su banda temporal (buckets).
+    if scenarios is None:
+        scenarios = DEFAULT_SCENARIOS
+    eve_by_group = calculate_eve_krd_bucketed if bucketed else calculate_eve_krd_by_group
+    nii_by_group = calculate_nii_bucketed if bucketed else calculate_nii_by_group
+    eve = np.zeros((n_groups, len(scenarios.eve)))
+    nii = np.zeros((n_groups, len(scenarios.nii)))
+    gap = np.zeros((n_groups, len(GAP_FIELDS) * N_BUCKETS))
+    krd = np.zeros((n_groups, len(key_rate_tenors)))
+    profile = CashflowProfile()
+    for rows, curve, cashflows in _iter_cashflows(portfolio, curve_df, valuation_date, forward_only):
+        groups = group_of_contract[rows][cashflows["contract_index"]]
+        eve_part, krd_part = eve_by_group(cashflows, curve, groups, n_groups, scenarios.eve, key_rate_tenors)
+        eve += eve_part
+        krd += krd_part
+        nii += nii_by_group(cashflows, curve, groups, n_groups, scenario_columns=scenarios.nii)
+        gap += gap_by_group(cashflows, groups, n_groups)
+        profile.add({curve_key(curve): day_profile(cashflows)})
+    return eve, nii, {"profile": profile.tables, "gap": gap, "krd": krd}
+
+
+def price_contracts(portfolio, curve_df, valuation_date, forward_only=False, scenarios=None, bucketed=False, key_rate_tenors=KEY_RATE_TENORS):
+    # EVE/NII de cada contrato del trozo: matrices contratos x escenarios (+ agregados de los flujos)
+    n_contracts = len(portfolio["id"])
+    return price_chunk(
+        portfolio, np.arange(n_contracts), n_contracts, curve_df, valuation_date, forward_only, scenarios, bucketed, key_rate_tenors
+    )
+
+
+def price_portfolio(chunks, curve_df, valuation_date, forward_only=False, workers=1, accumulator=None, on_contracts=None, progress=None, bucketed=False):
+    # Valora una cartera que llega por trozos (iter_portfolio / iter_chunks) y devuelve el
+    # acumulador. Con workers > 1 los trozos se reparten en un ProcessPoolExecutor con a lo
+    # sumo 2 * workers trozos en vuelo, y los parciales se suman en el orden de llegada de
+    # los trozos para que el resultado sea el mismo que en serie.
+    # Con on_contracts(chunk, eve, nii) cada trozo se valora contrato a contrato y se pasan
+    # los valores individuales (para guardar contribuciones) antes de sumarlos.
+    # progress(contratos) se llama con los contratos valorados tras cada trozo.
+    # Los escenarios y tipos clave que se evaluan son los del acumulador.
+    # bucketed: EVE/NII por bandas temporales en vez de flujo a flujo (ver price_chunk).
+    if accumulator is None:
+        accumulator = PortfolioAccumulator()
+    scenarios = accumulator.scenarios
+    tenors = accumulator.key_rate_tenors
+    done = 0
+
+    if workers is None or workers <= 1:
+        for chunk in chunks:
+            if on_contracts is not None:
+                eve, nii, flows = price_contracts(chunk, curve_df, valuation_date, forward_only, scenarios, bucketed, tenors)
+                on_contracts(chunk, eve, nii)
+                accumulator.add_contracts(chunk, eve, nii, flows=flows)
+            else:
+                codes = accumulator.group_codes(chunk)
+                eve, nii, flows = price_chunk(
+                    chunk, codes, accumulator.n_groups, curve_df, valuation_date, forward_only, scenarios, bucketed, tenors
+                )
+                accumulator.add(chunk, codes, eve, nii, flows=flows)
+            done += portfolio_size(chunk)
+            if progress is not None:
+                progress(done)
+        return accumulator
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for chunk in chunks:
+            if on_contracts is not None:
+                codes = None
+                future = pool.submit(price_contracts, chunk, curve_df, valuation_date, forward_only, scenarios, bucketed, tenors)
+            else:
+                codes = accumulator.group_codes(chunk)
+                future = pool.submit(
+                    price_chunk, chunk, codes, accumulator.n_groups, curve_df, valuation_date, forward_only, scenarios,
+                    bucketed, tenors,
+                )
+            pending.append((chunk, codes, future))
+            if len(pending) >= 2 * workers:
+                done += _collect(accumulator, pending.popleft(), on_contracts)
+                if progress is not None:
+                    progress(done)
+        while pending:
+            done += _collect(accumulator, pending.popleft(), on_contracts)
+            if progress is not None:
+                progress(done)
+    return accumulator
+
+
+def _collect(accumulator, item, on_contracts=None):
+    chunk, codes, future = item
+    eve, nii, flows = future.result()
+    if codes is None:
+        on_contracts(chunk, eve, nii)
+        accumulator.add_contracts(chunk, eve, nii, flows=flows)
+    else:
+        accumulator.add(chunk, codes, eve, nii, flows=flows)
+    return portfolio_size(chunk)
@@ -0,0 +1,123 @@
+import hashlib
+import json
+
+import numpy as np
+
+from .curve import CurveSet
+from .eve_calculation import SCENARIO_COLUMNS as EVE_SCENARIOS
+from .nii_calculation import SCENARIO_COLUMNS as NII_SCENARIOS
+from .utils import interpolate_columns, tenors_to_years
+
+# Escenarios de tipos definidos como datos (modelo Escenario). Cada escenario añade una
+# columna rate_<codigo>_curve a las curvas y se evalua junto con los de la EBA en la misma
+# pasada sobre los flujos: el coste es una columna mas en la tabla diaria de la curva.
+#
+# Tipos y parametros (en pb; decay_years por defecto 4, como los shocks de la EBA):
+#   parallel  {"bp": 100}
+#   short     {"bp": 250, "decay_years": 4}                -> bp * exp(-t / decay)
+#   long      {"bp": 100, "decay_years": 4}                -> bp * (1 - exp(-t / decay))
+#   twist     {"short_bp": -100, "long_bp": 150, "decay_years": 4}
+#   key_rate  {"bumps": {"5Y": 10, "10Y": -5}}             -> en el punto de la curva mas
+#             cercano a cada plazo; entre puntos se interpola, asi que el bump es un triangulo
+
+SHOCK_TYPES = ("parallel", "short", "long", "twist", "key_rate")
+DEFAULT_DECAY_YEARS = 4.0
+
+# codigos ya usados por los escenarios fijos (eve_<codigo> / nii_<codigo>) y por las columnas
+# de las curvas que no son escenario (rate_flat_curve); un escenario con uno de esos codigos
+# sobrescribiria la columna rate_<codigo>_curve
+CURVE_CODES = ("flat", "base")
+RESERVED_CODES = {name.split("_", 1)[1] for name in list(EVE_SCENARIOS) + list(NII_SCENARIOS)} | set(CURVE_CODES)
+
+
+def scenario_column(codigo):
+    return f"rate_{codigo}_curve"
+
+
+def _decay(parametros):
+    decay = float(parametros.get("decay_years", DEFAULT_DECAY_YEARS))
+    if decay <= 0:
+        raise ValueError("decay_years debe ser positivo")
+    return decay
+
+
+def scenario_shock(maturities, tipo, parametros):
+    # shock en pb en cada punto de la curva (maturities en años)
+    t = np.asarray(maturities, dtype=np.float64)
+    if tipo == "parallel":
+        return np.full(len(t), float(parametros["bp"]))
+    if tipo == "short":
+        return float(parametros["bp"]) * np.exp(-t / _decay(parametros))
+    if tipo == "long":
+        return float(parametros["bp"]) * (1 - np.exp(-t / _decay(parametros)))
+    if tipo == "twist":
+        short = np.exp(-t / _decay(parametros))
+        return float(parametros.get("short_bp", 0)) * short + float(parametros.get("long_bp", 0)) * (1 - short)
+    if tipo == "key_rate":
+        bumps = parametros.get("bumps", {})
+        shock = np.zeros(len(t))
+        if bumps:
+            years = tenors_to_years(list(bumps))
+            nearest = np.abs(t[None, :] - years[:, None]).argmin(axis=1)
+            np.add.at(shock, nearest, np.asarray([float(bp) for bp in bumps.values()]))
+        return shock
+    raise ValueError(f"Tipo de escenario no valido: {tipo}")
+
+
+def shock_by_day(curve_df, tipo, parametros, n_days):
+    # shock en pb de cada dia 0..n_days-1 (t = dia / 360), interpolado entre los puntos de
+    # la curva igual que las columnas de escenario en la tabla diaria (CurveGrid)
+    maturities = curve_df["maturity_years"].to_numpy(dtype=np.float64)
+    points = scenario_shock(maturities, tipo, parametros)[:, None]
+    return interpolate_columns(np.arange(n_days) / 360, maturities, points)[:, 0]
+
+
+def validate_scenario(codigo, tipo, parametros):
+    # lanza ValueError con el motivo si la definicion no se puede evaluar
+    if codigo in RESERVED_CODES:
+        raise ValueError(f"El codigo '{codigo}' esta reservado para las curvas y los escenarios de la EBA")
+    if tipo not in SHOCK_TYPES:
+        raise ValueError(f"Tipo de escenario no valido: {tipo}")
+    if not isinstance(parametros, dict):
+        raise ValueError("Los parametros deben ser un objeto JSON")
+    try:
+        scenario_shock(np.array([0.25, 1.0, 10.0]), tipo, parametros)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Parametros no validos para '{tipo}': {e}")
+
+
+class ScenarioSet:
+    # Escenarios EBA + definidos por el usuario. eve / nii: {nombre de metrica: columna}
+    def __init__(self, definitions=()):
+        self.definitions = [
+            {"codigo": d["codigo"], "tipo": d["tipo"], "parametros": dict(d.get("parametros") or {})} for d in definitions
+        ]
+        self.eve = dict(EVE_SCENARIOS)
+        self.nii = dict(NII_SCENARIOS)
+        for d in self.definitions:
+            self.eve[f"eve_{d['codigo']}"] = scenario_column(d["codigo"])
+            self.nii[f"nii_{d['codigo']}"] = scenario_column(d["codigo"])
+
+    def key(self):
+        if not self.definitions:
+            return ""
+        payload = json.dumps(self.definitions, sort_keys=True)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def apply_curve(self, curve_df):
+        # añade las columnas de los escenarios de usuario sobre la curva base
+        if not self.definitions:
+            return curve_df
+        maturities = curve_df["maturity_years"].to_numpy(dtype=np.float64)
+        base = curve_df["rate_base_curve"].to_numpy(dtype=np.float64)
+        columns = {scenario_column(d["codigo"]): base + scenario_shock(maturities, d["tipo"], d["parametros"]) for d in self.definitions}
+        return curve_df.assign(**columns)
+
+    def apply(self, curves):
+        # curves: DataFrame o CurveSet
+        if isinstance(curves, CurveSet):
+            return CurveSet(self.apply_curve(curves.default), {name: self.apply_curve(df) for name, df in curves.curves.items()})
+        return self.apply_curve(curves)
+
+
+DEFAULT_SCENARIOS = ScenarioSet()
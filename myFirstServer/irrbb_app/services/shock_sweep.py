@@ -0,0 +1,40 @@
+import numpy as np
+
+from .curve import curves_by_key
+from .eve_calculation import calculate_eve_sweep
+from .nii_calculation import calculate_nii_sweep
+from .scenarios import shock_by_day
+
+# Barrido de shocks: EVE y NII para cientos de niveles de shock de cada forma (paralelo,
+# corto, largo) sobre los flujos ya agregados por dia de la cartera (CashflowProfile), sin
+# volver a generar flujos. La forma corta / larga con n pb es n * exp(-t/4) / n * (1 - exp(-t/4)),
+# asi que en 350 / 200 coinciden con los shocks short / long de la EBA.
+
+SWEEP_SHAPES = ("parallel", "short", "long")
+DEFAULT_SWEEP_RANGE = (-400, 400, 25)
+
+
+def sweep_shocks(start, stop, step):
+    # niveles en pb de start a stop (incluido)
+    return np.arange(start, stop + step / 2, step, dtype=np.float64)
+
+
+def shock_sweep(profile, curves, shocks_bp, shapes=SWEEP_SHAPES, horizon_years=1.0):
+    # -> {"shocks_bp": [...], "eve": {forma: [...]}, "nii": {forma: [...]}}, sumando las
+    # tablas de todas las curvas del perfil
+    shocks_bp = np.asarray(shocks_bp, dtype=np.float64)
+    frames = curves_by_key(curves)
+    eve = {shape: np.zeros(len(shocks_bp)) for shape in shapes}
+    nii = {shape: np.zeros(len(shocks_bp)) for shape in shapes}
+    for key, values in profile.tables.items():
+        curve_df = frames[key]
+        table = profile.table(key)
+        for shape in shapes:
+            unit = shock_by_day(curve_df, shape, {"bp": 1}, values.shape[1])
+            eve[shape] += calculate_eve_sweep(table, curve_df, shocks_bp, unit)
+            nii[shape] += calculate_nii_sweep(table, shocks_bp, unit, horizon_years)
+    return {
+        "shocks_bp": shocks_bp.tolist(),
+        "eve": {shape: values.tolist() for shape, values in eve.items()},
+        "nii": {shape: values.tolist() for shape, values in nii.items()},
+    }
@@ -18,11 +18,19 @@ def tenor_to_years(tenor): #6M a 0,5años
         raise ValueError("Tenor no válido. Usa M o Y")
 
 
-def normalize_curve_points(plazos, tipos): 
-    años = []
+def tenors_to_years(tenores): #["1M", "6M", "2Y"] -> array([0.0833, 0.5, 2.0])
+    tenores = np.char.strip(np.char.upper(np.asarray(tenores, dtype=str)))
+    meses = np.char.endswith(tenores, "M")
+    años = np.char.endswith(tenores, "Y")
+    if not (meses | años).all():
+        raise ValueError("Tenor no válido. Usa M o Y")
+
+    numero = np.char.rstrip(tenores, "MY").astype(np.float64)
+    return np.where(meses, numero / 12, numero)
+
 
-    for p in plazos:
-        años.append(tenor_to_years(p))
+def normalize_curve_points(plazos, tipos): 
+    años = tenors_to_years(plazos).tolist()
 
     return años, tipos
 
@@ -42,6 +50,90 @@ def year_fraction_30_360(fecha_inicio, fecha_fin):
     return dias / 360
 
 
+# --- versiones vectorizadas: arrays datetime64[D] -> arrays float ---
+
+def date_parts(fechas): # datetime64[D] -> (año, mes, dia) como arrays de enteros
+    fechas = np.asarray(fechas, dtype="datetime64[D]")
+    meses = fechas.astype("datetime64[M]")
+    años = meses.astype(np.int64) // 12 + 1970
+    mes = meses.astype(np.int64) % 12 + 1
+    dia = (fechas - meses.astype("datetime64[D]")).astype(np.int64) + 1
+    return años, mes, dia
+
+
+def days_in_month(meses): # datetime64[M] -> dias de cada mes
+    return ((meses + 1).astype("datetime64[D]") - meses.astype("datetime64[D]")).astype(np.int64)
+
+
+def _days_30_360(y1, m1, d1, y2, m2, d2):
+    return 360 * (y2 - y1) + 30 * (m2 - m1) + (d2 - d1)
+
+
+def year_fraction_30_360_array(fecha_inicio, fecha_fin):
+    # misma regla que year_fraction_30_360: los dias 31 cuentan como 30
+    y1, m1, d1 = date_parts(fecha_inicio)
+    y2, m2, d2 = date_parts(fecha_fin)
+    return _days_30_360(y1, m1, np.minimum(d1, 30), y2, m2, np.minimum(d2, 30)) / 360
+
+
+def year_fraction_30e_360_array(fecha_inicio, fecha_fin):
+    # 30E/360 ISDA: el ultimo dia de cada mes (febrero incluido) cuenta como 30
+    fecha_inicio = np.asarray(fecha_inicio, dtype="datetime64[D]")
+    fecha_fin = np.asarray(fecha_fin, dtype="datetime64[D]")
+    y1, m1, d1 = date_parts(fecha_inicio)
+    y2, m2, d2 = date_parts(fecha_fin)
+    d1 = np.where(d1 == days_in_month(fecha_inicio.astype("datetime64[M]")), 30, d1)
+    d2 = np.where(d2 == days_in_month(fecha_fin.astype("datetime64[M]")), 30, d2)
+    return _days_30_360(y1, m1, d1, y2, m2, d2) / 360
+
+
+def year_fraction_act_360_array(fecha_inicio, fecha_fin):
+    dias = (np.asarray(fecha_fin, dtype="datetime64[D]") - np.asarray(fecha_inicio, dtype="datetime64[D]")).astype(np.int64)
+    return dias / 360
+
+
+def year_fraction_act_365_array(fecha_inicio, fecha_fin):
+    dias = (np.asarray(fecha_fin, dtype="datetime64[D]") - np.asarray(fecha_inicio, dtype="datetime64[D]")).astype(np.int64)
+    return dias / 365
+
+
+DAY_COUNT_CONVENTIONS = {
+    "30/360": year_fraction_30_360_array,
+    "30E/360": year_fraction_30e_360_array,
+    "ACT/360": year_fraction_act_360_array,
+    "ACT/365": year_fraction_act_365_array,
+}
+
+
+def year_fractions(fecha_inicio, fecha_fin, convention="30/360"):
+    try:
+        day_count = DAY_COUNT_CONVENTIONS[convention.upper()]
+    except KeyError:
+        raise ValueError(f"Convención no válida: {convention}. Usa {', '.join(DAY_COUNT_CONVENTIONS)}")
+    return day_count(fecha_inicio, fecha_fin)
+
+
+def interpolation_weights(x, xp):
+    # indices y pesos de np.interp (extrapolacion plana) para reutilizarlos en varias columnas
+    x = np.clip(np.asarray(x, dtype=np.float64), xp[0], xp[-1])
+    if len(xp) == 1:
+        return np.zeros(len(x), dtype=np.int64), np.zeros(len(x))
+    i = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, len(xp) - 2)
+    w = (x - xp[i]) / (xp[i + 1] - xp[i])
+    return i, w
+
+
+def interpolate_columns(x, xp, points):
+    # np.interp de todas las columnas de points (puntos x columnas) a la vez
+    i, w = interpolation_weights(x, xp)
+    if len(xp) == 1:
+        return points[i].copy()
+    values = points[i]
+    values *= (1 - w)[:, None]
+    values += points[i + 1] * w[:, None]
+    return values
+
+
 def interpolate_rate(curve_df, column, year_value):
     maturities = curve_df["maturity_years"].to_numpy()
     rates = curve_df[column].to_numpy()
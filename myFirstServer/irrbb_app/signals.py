@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Curva
+from .services.curve import invalidate_curve_cache
+
+
+@receiver(post_save, sender=Curva)
+@receiver(post_delete, sender=Curva)
+def curva_changed(sender, **kwargs):
+    invalidate_curve_cache()
@@ -0,0 +1,178 @@
+import io
+import tempfile
+import threading
+from unittest import mock
+
+import pandas as pd
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from .models import Banco, Contrato, Escenario, ResultadoEscenario, Trabajo
+from .services import contract_pricing, jobs
+from .services.curve import build_default_curve
+from .services.curve_registry import load_scenario_set
+from .services.scenarios import RESERVED_CODES
+from .services.import_excel import import_contracts_streaming
+
+METRICS = ("eve_base", "eve_parallel_up", "eve_short_down", "nii_base", "nii_parallel_down")
+
+
+def contracts_csv(rows):
+    buffer = io.BytesIO(pd.DataFrame(rows).to_csv(index=False).encode())
+    buffer.name = "contratos.csv"
+    return buffer
+
+
+def sample_rows(n=40):
+    return [
+        {
+            "NumeroContrato": f"C{i:03d}",
+            "Producto": ("Loans and advances", "Debt securities", "Term deposits")[i % 3],
+            "ActivoPasivo": "PASIVO" if i % 3 == 2 else "ACTIVO",
+            "Nominal": 100000 + 2500 * i,
+            "FechaInicio": f"{2018 + i % 5}-0{1 + i % 9}-15",
+            "FechaVencimiento": f"{2027 + i % 8}-0{1 + i % 9}-15",
+            "TipoInteres": "VARIABLE" if i % 4 == 0 else "FIJO",
+            "Amortizacion": ("FRANCESA", "ALEMANA", "BULLET")[i % 3],
+            "CuponSpread": 1.5 + (i % 7) * 0.25,
+            "Curva": "",
+            "Frecuencia": (1, 2, 4, 12)[i % 4],
+        }
+        for i in range(n)
+    ]
+
+
+@override_settings(IRRBB_SIMULATION_PATHS=0, IRRBB_SWEEP_SHOCKS_BP=None)
+class IncrementalPricingTests(TestCase):
+    def setUp(self):
+        self.banco = Banco.objects.create(nombre="TEST")
+        self.rows = sample_rows()
+        import_contracts_streaming(contracts_csv(self.rows), self.banco)
+        contract_pricing.run_balance_pricing(self.banco)
+
+    def _import_changes(self):
+        rows = [dict(row) for row in self.rows]
+        rows[0]["Nominal"] += 5000
+        rows[1]["CuponSpread"] = 4.0
+        rows.append({**rows[2], "NumeroContrato": "NUEVO"})
+        del rows[3]
+        return import_contracts_streaming(contracts_csv(rows), self.banco, mode="sync")
+
+    def _run(self, changes):
+        # valoracion con changes; devuelve (resultado, si se valoro toda la cartera)
+        with mock.patch.object(contract_pricing, "_process_contracts", wraps=contract_pricing._process_contracts) as full:
+            resultado = contract_pricing.run_balance_pricing(self.banco, changes=changes)["resultado"]
+        return resultado, full.called
+
+    def assertSameResult(self, resultado, esperado):
+        for metric in METRICS:
+            self.assertAlmostEqual(getattr(resultado, metric), getattr(esperado, metric), delta=1e-9 * abs(getattr(esperado, metric)))
+        self.assertAlmostEqual(resultado.metadata["dv01"], esperado.metadata["dv01"], delta=1e-9 * abs(esperado.metadata["dv01"]))
+        for side in ("activos", "pasivos"):
+            self.assertEqual(
+                {producto: datos["count"] for producto, datos in resultado.metadata[side].items()},
+                {producto: datos["count"] for producto, datos in esperado.metadata[side].items()},
+            )
+
+    def test_incremental_run_matches_full_run(self):
+        incremental, full_run = self._run(self._import_changes())
+        self.assertFalse(full_run)
+        completo = contract_pricing.run_balance_pricing(self.banco)["resultado"]
+        self.assertSameResult(incremental, completo)
+
+    def test_edit_outside_import_forces_full_run(self):
+        # un cambio que no viene en el informe de la importacion (admin, script, trabajo fallido)
+        Contrato.objects.filter(banco=self.banco, numero_contrato="C010").update(nominal=999999)
+        cambio = {**self.rows[0], "Nominal": self.rows[0]["Nominal"] + 5000}
+        resultado, full_run = self._run(import_contracts_streaming(contracts_csv([cambio]), self.banco))
+        self.assertTrue(full_run)
+        completo = contract_pricing.run_balance_pricing(self.banco)["resultado"]
+        self.assertSameResult(resultado, completo)
+
+
+@override_settings(IRRBB_SIMULATION_PATHS=0, IRRBB_SWEEP_SHOCKS_BP=None)
+class NiiProjectionTests(TestCase):
+    def test_past_cashflows_do_not_enter_projection(self):
+        # los flujos ya pagados (recortados al dia 0) no cuentan como NII ni se renuevan
+        banco = Banco.objects.create(nombre="TEST")
+        import_contracts_streaming(contracts_csv(sample_rows()), banco)
+        proyecciones = []
+        for forward_only in (False, True):
+            with override_settings(IRRBB_FORWARD_ONLY_CASHFLOWS=forward_only):
+                resultado = contract_pricing.run_balance_pricing(banco)["resultado"]
+            proyecciones.append(resultado.metadata["nii_projection"]["monthly"])
+        completa, forward = proyecciones
+        for escenario, meses in forward.items():
+            for valor, esperado in zip(completa[escenario], meses):
+                self.assertAlmostEqual(valor, esperado, delta=1e-9 * max(abs(esperado), 1))
+
+
+@override_settings(IRRBB_SIMULATION_PATHS=0, IRRBB_SWEEP_SHOCKS_BP=None, MEDIA_ROOT=tempfile.mkdtemp())
+class ImportJobTests(TransactionTestCase):
+    def setUp(self):
+        self.banco = Banco.objects.create(nombre="TEST")
+        self.rows = sample_rows(5)
+        import_contracts_streaming(contracts_csv(self.rows), self.banco)
+        cambio = {**self.rows[0], "Nominal": self.rows[0]["Nominal"] + 5000}
+        self.trabajo = jobs.enqueue_import(contracts_csv([cambio]), self.banco)
+        self.assertTrue(jobs.claim_job(self.trabajo))
+
+    def test_pricing_failure_keeps_import_and_requeues_pricing(self):
+        with mock.patch.object(contract_pricing, "run_balance_pricing", side_effect=RuntimeError("fallo")):
+            jobs.run_job(self.trabajo)
+        self.assertEqual(self.trabajo.estado, Trabajo.ERROR)
+        self.assertEqual(Contrato.objects.get(banco=self.banco, numero_contrato="C000").nominal, self.rows[0]["Nominal"] + 5000)
+        reintento = Trabajo.objects.get(pk=self.trabajo.informe["reintento"])
+        self.assertEqual((reintento.tipo, reintento.estado), (Trabajo.VALORAR, Trabajo.PENDIENTE))
+
+    def test_upload_while_job_is_pricing(self):
+        # una subida desde otra conexion (la peticion web) mientras el worker valora
+        errores = []
+
+        def subir():
+            try:
+                jobs.enqueue_import(contracts_csv(self.rows), self.banco)
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        def valorar(*args, **kwargs):
+            hilo = threading.Thread(target=subir)
+            hilo.start()
+            hilo.join()
+            return None
+
+        with mock.patch.object(contract_pricing, "run_balance_pricing", side_effect=valorar):
+            jobs.run_job(self.trabajo)
+        self.assertEqual(errores, [])
+        self.assertEqual(self.trabajo.estado, Trabajo.COMPLETADO)
+        self.assertEqual(Trabajo.objects.filter(estado=Trabajo.PENDIENTE).count(), 1)
+
+
+class ScenarioTests(TestCase):
+    def test_reserved_codes_cover_curve_columns(self):
+        columnas = [col for col in build_default_curve().columns if col.startswith("rate_")]
+        self.assertTrue(all(col[len("rate_"):-len("_curve")] in RESERVED_CODES for col in columnas))
+
+    @override_settings(IRRBB_SIMULATION_PATHS=0, IRRBB_SWEEP_SHOCKS_BP=None)
+    def test_user_scenario_results(self):
+        banco = Banco.objects.create(nombre="TEST")
+        import_contracts_streaming(contracts_csv(sample_rows(5)), banco)
+        Escenario.objects.create(codigo="subida_50", nombre="Subida", tipo=Escenario.PARALLEL, parametros={"bp": 50})
+        resultado = contract_pricing.run_balance_pricing(banco)["resultado"]
+        guardados = ResultadoEscenario.objects.filter(resultado=resultado, escenario="subida_50")
+        self.assertEqual(sorted(guardados.values_list("metrica", flat=True)), ["EVE", "NII"])
+        self.assertEqual(guardados.first().definicion["parametros"], {"bp": 50})
+
+    def test_curve_column_codes_are_reserved(self):
+        escenario = Escenario(codigo="flat", nombre="Plano", tipo=Escenario.PARALLEL, parametros={"bp": 50})
+        with self.assertRaisesMessage(ValidationError, "reservado"):
+            escenario.full_clean()
+
+    def test_invalid_stored_scenario_is_rejected(self):
+        # guardado sin clean(): la valoracion falla con un mensaje claro
+        Escenario.objects.create(codigo="flat", nombre="Plano", tipo=Escenario.PARALLEL, parametros={"bp": 50})
+        with self.assertRaisesMessage(ValueError, "Escenario flat no valido"):
+            load_scenario_set()
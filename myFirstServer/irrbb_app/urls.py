@@ -8,5 +8,7 @@ urlpatterns = [
     path("upload/", views.upload_contracts, name="upload_contracts"),
     path("resultados/", views.results_history, name="results_history"),
     path("resultados/<int:pk>/", views.DetailView.as_view(), name="detail"),
+    path("trabajos/<int:pk>/", views.job_detail, name="job_detail"),
+    path("trabajos/<int:pk>/estado/", views.job_status, name="job_status"),
     path("download_template/", views.download_template, name="download_template"),
 ]
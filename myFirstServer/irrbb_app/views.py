@@ -1,19 +1,20 @@
-from django.http import HttpResponse, Http404
+from django.conf import settings
+from django.http import HttpResponse, Http404, JsonResponse
 from openpyxl import Workbook
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import redirect, render
 from django.urls import reverse_lazy
-from django.views.generic import FormView, ListView, TemplateView
+from django.views.generic import FormView, ListView, TemplateView, View
 
 from users.models import CustomUser
 
 from .forms import UploadContractsForm
-from .models import Banco, Contrato, ResultadoBalance
-from .services import contract_pricing, import_excel
-from .services.contract_pricing import _process_contracts
-from .services.curve import build_default_curve
+from .models import Banco, Contrato, ResultadoBalance, Trabajo
+from .services import jobs
+from .services.buckets import BUCKET_LABELS, N_BUCKETS
+from .services.contract_pricing import get_breakdown
 from .services.export_j03 import export_excel
 
 
@@ -40,23 +41,20 @@ class UploadContractsView(LoginRequiredMixin, FormView):
             messages.error(self.request, "El usuario no tiene un banco asociado")
             return self.form_invalid(form)
 
-        try:
-            es_valido, errores = import_excel.validate_contracts_excel(form.cleaned_data["excel_file"])
-            
-            if not es_valido:
-                messages.error(self.request, "Hay errores en el excel - Importación cancelada:")
-                for e in errores:
-                    messages.error(self.request, e)
+        # la importacion y la valoracion se hacen en el worker (manage.py irrbb_worker)
+        trabajo = jobs.enqueue_import(
+            form.cleaned_data["excel_file"], banco, uploaded_by=uploaded_by, modo=form.cleaned_data["modo"] or "upsert"
+        )
+        if getattr(settings, "IRRBB_RUN_JOBS_INLINE", False) and jobs.claim_job(trabajo):
+            jobs.run_job(trabajo)
+            if trabajo.estado == Trabajo.ERROR:
+                # procesado en la peticion: los errores se muestran en el propio formulario
+                messages.error(self.request, trabajo.error)
+                for error in trabajo.informe.get("errores", []):
+                    messages.error(self.request, error["message"])
                 return self.form_invalid(form)
-            
-            count = import_excel.load_contracts_from_excel(form.cleaned_data["excel_file"], banco)
-            messages.success(self.request, f" Importados {count} contratos correctamente")
-        except Exception as e:
-            messages.error(self.request, f" Error: {str(e)}")
-            return self.form_invalid(form)
-
-        contract_pricing.run_balance_pricing(banco, uploaded_by=uploaded_by)
-        return redirect("dashboard")
+        messages.success(self.request, f" Fichero recibido: trabajo #{trabajo.pk}")
+        return redirect("job_detail", pk=trabajo.pk)
 
 
 class ResultsHistoryView(LoginRequiredMixin, ListView):
@@ -79,6 +77,169 @@ class ResultsHistoryView(LoginRequiredMixin, ListView):
             context["banks"] = []
         return context
 
+def _user_scenarios(resultado):
+    # escenarios de usuario del resultado: EVE y NII con su diferencia frente a la base
+    filas = {}
+    for escenario in resultado.escenarios.all():
+        if not escenario.definicion:
+            continue
+        fila = filas.setdefault(escenario.escenario, {"codigo": escenario.escenario, "definicion": escenario.definicion})
+        if escenario.metrica == "EVE":
+            fila["eve"] = escenario.valor
+            fila["delta_eve"] = escenario.valor - resultado.eve_base
+        else:
+            fila["nii"] = escenario.valor
+            fila["delta_nii"] = escenario.valor - resultado.nii_base
+    return list(filas.values())
+
+
+# grafico del barrido de shocks (SVG en la propia pagina)
+SWEEP_CHART_WIDTH = 640
+SWEEP_CHART_HEIGHT = 240
+SWEEP_CHART_MARGIN = 20
+SWEEP_COLORS = {"parallel": "#58a6ff", "short": "#3fb950", "long": "#d29922"}
+
+
+def _sweep_chart(resultado):
+    # ΔEVE / ΔNII frente al nivel de shock por forma: filas para la tabla y polilineas SVG
+    sweep = (resultado.metadata or {}).get("sweep")
+    if not sweep or not sweep["shocks_bp"]:
+        return None
+    shocks = sweep["shocks_bp"]
+    formas = list(sweep["eve"])
+    delta_eve = {forma: [v - resultado.eve_base for v in sweep["eve"][forma]] for forma in formas}
+    delta_nii = {forma: [v - resultado.nii_base for v in sweep["nii"][forma]] for forma in formas}
+
+    valores = [0.0] + [v for values in delta_eve.values() for v in values]
+    lo, hi = min(valores), max(valores)
+    span = (hi - lo) or 1.0
+    width = SWEEP_CHART_WIDTH - 2 * SWEEP_CHART_MARGIN
+    height = SWEEP_CHART_HEIGHT - 2 * SWEEP_CHART_MARGIN
+
+    def x(i):
+        return SWEEP_CHART_MARGIN + i * width / max(len(shocks) - 1, 1)
+
+    def y(value):
+        return SWEEP_CHART_MARGIN + (hi - value) * height / span
+
+    lineas = [
+        {
+            "forma": forma,
+            "color": SWEEP_COLORS.get(forma, "#e6edf3"),
+            "puntos": " ".join(f"{x(i):.1f},{y(v):.1f}" for i, v in enumerate(delta_eve[forma])),
+        }
+        for forma in formas
+    ]
+    filas = [
+        {"shock": shock, "eve": [delta_eve[forma][i] for forma in formas], "nii": [delta_nii[forma][i] for forma in formas]}
+        for i, shock in enumerate(shocks)
+    ]
+    return {
+        "formas": formas,
+        "lineas": lineas,
+        "filas": filas,
+        "width": SWEEP_CHART_WIDTH,
+        "height": SWEEP_CHART_HEIGHT,
+        "cero": f"{y(0.0):.1f}",
+        "x_min": f"{x(0):.1f}",
+        "x_max": f"{x(len(shocks) - 1):.1f}",
+        "desde": shocks[0],
+        "hasta": shocks[-1],
+    }
+
+
+def _gap_table(activos, pasivos):
+    # flujos por banda temporal de activo y pasivo (los del pasivo van en negativo), gap y
+    # gap acumulado. None si el resultado se calculo antes de guardar las bandas.
+    productos = [*activos.values(), *pasivos.values()]
+    if not productos or any("gap" not in datos for datos in productos):
+        return None
+    activo = [sum(datos["gap"]["cashflow"][i] for datos in activos.values()) for i in range(N_BUCKETS)]
+    pasivo = [sum(datos["gap"]["cashflow"][i] for datos in pasivos.values()) for i in range(N_BUCKETS)]
+    variable = [sum(datos["gap"]["repricing_notional"][i] for datos in productos) for i in range(N_BUCKETS)]
+    filas = []
+    acumulado = 0.0
+    for i, banda in enumerate(BUCKET_LABELS):
+        gap = activo[i] + pasivo[i]
+        acumulado += gap
+        filas.append({
+            "banda": banda,
+            "activo": activo[i],
+            "pasivo": pasivo[i],
+            "gap": gap,
+            "acumulado": acumulado,
+            "variable": variable[i],
+        })
+    return filas
+
+
+def _krd_table(resultado, activos, pasivos):
+    # PV01 por tipo clave de cada producto, DV01 (suma) y total del balance. Los tipos clave
+    # son los guardados con el resultado (los anteriores a guardarlos, los del desglose)
+    productos = [("Activo", activos), ("Pasivo", pasivos)]
+    con_krd = [(lado, producto, datos["krd"]) for lado, datos_lado in productos for producto, datos in datos_lado.items() if "krd" in datos]
+    if not con_krd:
+        return None
+    tenores = (resultado.metadata or {}).get("key_rate_tenors") or list(con_krd[0][2])
+    filas = [
+        {"lado": lado, "producto": producto, "krd": [krd.get(tenor, 0) for tenor in tenores], "dv01": sum(krd.values())}
+        for lado, producto, krd in con_krd
+    ]
+    total = [sum(fila["krd"][i] for fila in filas) for i in range(len(tenores))]
+    return {"tenores": tenores, "filas": filas, "total": total, "dv01": (resultado.metadata or {}).get("dv01", sum(total))}
+
+
+def _simulation_table(resultado):
+    # cuantiles de EVE / NII de la simulacion con su diferencia frente a la base
+    simulacion = (resultado.metadata or {}).get("simulation")
+    if not simulacion:
+        return None
+    filas = [
+        {
+            "cuantil": q * 100,
+            "eve": eve,
+            "delta_eve": eve - resultado.eve_base,
+            "nii": nii,
+            "delta_nii": nii - resultado.nii_base,
+        }
+        for q, eve, nii in zip(simulacion["quantiles"], simulacion["eve"], simulacion["nii"])
+    ]
+    return {**simulacion, "confianza": simulacion["confidence"] * 100, "filas": filas}
+
+
+def _nii_projection_table(resultado):
+    # NII acumulado de cada escenario a cada horizonte y su diferencia frente a la base
+    proyeccion = (resultado.metadata or {}).get("nii_projection")
+    if not proyeccion:
+        return None
+    horizontes = list(proyeccion["totals"])
+    escenarios = list(proyeccion["monthly"])
+    base = escenarios[0]
+    filas = [
+        {
+            "escenario": escenario,
+            "valores": [
+                {"nii": proyeccion["totals"][h][escenario], "delta": proyeccion["totals"][h][escenario] - proyeccion["totals"][h][base]}
+                for h in horizontes
+            ],
+        }
+        for escenario in escenarios
+    ]
+    return {"horizontes": horizontes, "filas": filas, "meses": proyeccion["months"], "balance_constante": proyeccion["constant_balance"]}
+
+
+def _pooling_table(resultado):
+    # pools valorados en vez de contratos y, si se comprobo, error frente a la valoracion exacta
+    pooling = (resultado.metadata or {}).get("pooling")
+    if not pooling:
+        return None
+    filas = [{"metrica": metrica, **valores} for metrica, valores in (pooling["error"] or {}).items()]
+    for fila in filas:
+        if fila["relative"] is not None:
+            fila["relative"] *= 100
+    return {**pooling, "reduccion": pooling["contracts"] / max(pooling["pools"], 1), "filas": filas}
+
+
 class DetailView(LoginRequiredMixin, TemplateView):
     template_name = "irrbb_app/detail.html"
 
@@ -89,9 +250,11 @@ class DetailView(LoginRequiredMixin, TemplateView):
     
     def _download_excel(self, *args, **kwargs):
         try:
-            resultado = ResultadoBalance.objects.get(pk=self.kwargs["pk"])
-            curve_df = build_default_curve()
-            activos, pasivos = _process_contracts(resultado.banco, curve_df)
+            resultado = ResultadoBalance.objects.select_related("banco").get(pk=self.kwargs["pk"])
+            activos, pasivos = get_breakdown(resultado)
+            if activos is None:
+                messages.error(self.request, "Desglose no disponible para este resultado: vuelve a valorar el balance")
+                return redirect("detail", pk=resultado.pk)
             return export_excel(resultado.fecha_calculo.strftime("%Y-%m-%d"), activos, pasivos, resultado.banco.nombre)
         
         except ResultadoBalance.DoesNotExist:
@@ -102,19 +265,52 @@ class DetailView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         try:
-            resultado = ResultadoBalance.objects.get(pk=self.kwargs["pk"])
-            curve_df = build_default_curve()
-            activos, pasivos = _process_contracts(resultado.banco, curve_df)
-            
+            resultado = ResultadoBalance.objects.select_related("banco").get(pk=self.kwargs["pk"])
+            activos, pasivos = get_breakdown(resultado)
+            desglose_disponible = activos is not None
+
             return {
                 "resultado": resultado,
+                "desglose_disponible": desglose_disponible,
                 "activos": activos,
-                "pasivos": pasivos
+                "pasivos": pasivos,
+                "escenarios_usuario": _user_scenarios(resultado),
+                "gaps": _gap_table(activos, pasivos) if desglose_disponible else None,
+                "sensibilidades": _krd_table(resultado, activos, pasivos) if desglose_disponible else None,
+                "barrido": _sweep_chart(resultado),
+                "simulacion": _simulation_table(resultado),
+                "proyeccion_nii": _nii_projection_table(resultado),
+                "agrupacion": _pooling_table(resultado),
             }
         except ResultadoBalance.DoesNotExist:
             raise Http404("Resultado de balance no encontrado")
 
 
+def _get_trabajo(request, pk):
+    # solo los trabajos del banco del usuario
+    try:
+        return Trabajo.objects.select_related("banco").get(pk=pk, banco=request.user.bank_name)
+    except Trabajo.DoesNotExist:
+        raise Http404("Trabajo no encontrado")
+
+
+class JobDetailView(LoginRequiredMixin, TemplateView):
+    template_name = "irrbb_app/trabajo.html"
+
+    def get_context_data(self, **kwargs):
+        trabajo = _get_trabajo(self.request, self.kwargs["pk"])
+        return {
+            "trabajo": trabajo,
+            "estado": jobs.job_status(trabajo),
+            "en_curso": trabajo.estado in (Trabajo.PENDIENTE, Trabajo.EN_CURSO),
+        }
+
+
+class JobStatusView(LoginRequiredMixin, View):
+    def get(self, request, pk):
+        return JsonResponse(jobs.job_status(_get_trabajo(request, pk)))
+
+
 def start(request):
     if request.user.is_authenticated:
         return redirect("dashboard")
@@ -146,3 +342,5 @@ def download_template(request):
 home = DashboardView.as_view()
 upload_contracts = UploadContractsView.as_view()
 results_history = ResultsHistoryView.as_view()
+job_detail = JobDetailView.as_view()
+job_status = JobStatusView.as_view()
@@ -68,9 +68,23 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # WAL: el servidor web puede leer el estado de los trabajos mientras el worker escribe
+        "OPTIONS": {"init_command": "PRAGMA journal_mode=WAL;"},
     }
 }
 
+# La cache "irrbb_jobs" guarda en disco el progreso de los trabajos en segundo plano para
+# que la vea el servidor web mientras el worker tiene la transaccion abierta
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "irrbb_jobs": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache" / "irrbb_jobs",
+    },
+}
+
 AUTH_USER_MODEL = "users.CustomUser"
 
 
@@ -103,8 +117,69 @@ STATIC_URL = "static/"
 
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
+MEDIA_URL = "media/"
+MEDIA_ROOT = BASE_DIR / "media"
+
 LOGIN_URL = "login"
 LOGIN_REDIRECT_URL = "dashboard"
 LOGOUT_REDIRECT_URL = "start"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# IRRBB: motor de calculo
+# Solo genera los flujos de los periodos que terminan despues de la fecha de valoracion
+IRRBB_FORWARD_ONLY_CASHFLOWS = False
+# Procesos para valorar la cartera en paralelo (1 = en serie) y contratos por trozo
+IRRBB_PRICING_WORKERS = 1
+IRRBB_PRICING_CHUNK_SIZE = 50000
+# Contratos por INSERT en la importacion (bulk_create)
+IRRBB_IMPORT_BATCH_SIZE = 2000
+# Errores de validacion que se detallan como maximo al importar
+IRRBB_IMPORT_MAX_ERRORS = 100
+# Filas por trozo al importar Excel en streaming
+IRRBB_IMPORT_CHUNK_SIZE = 10000
+# Recalculo incremental: fraccion maxima de contratos cambiados (sobre la cartera anterior)
+# para restar/sumar contribuciones en vez de valorar todo
+IRRBB_INCREMENTAL_MAX_FRACTION = 0.25
+# Trabajos en segundo plano: los procesa el worker, que se arranca aparte con
+#     python manage.py irrbb_worker
+# Segundos entre consultas de la cola, segundos sin latido para dar por muerto un trabajo
+# en curso, segundos pendiente tras los que la pagina del trabajo avisa de que no hay
+# worker, y si la subida se procesa dentro de la peticion en vez de encolarla (por defecto
+# en desarrollo, para no necesitar el worker)
+IRRBB_JOB_POLL_SECONDS = 2
+IRRBB_JOB_STALE_SECONDS = 900
+IRRBB_JOB_PENDING_WARNING_SECONDS = 30
+IRRBB_RUN_JOBS_INLINE = DEBUG
+# Barrido de shocks guardado con cada resultado: niveles en pb (desde, hasta, paso; None
+# para no calcularlo) y formas de shock (parallel, short, long)
+IRRBB_SWEEP_SHOCKS_BP = (-400, 400, 25)
+IRRBB_SWEEP_SHAPES = ("parallel", "short", "long")
+# Simulacion Hull-White para EVE / NII at risk: caminos (0 para no simular), parametros del
+# modelo (a, sigma; con b, eta y rho es de dos factores), horizonte en años, nivel de
+# confianza del at-risk, cuantiles que se guardan y semilla (None = aleatoria)
+IRRBB_SIMULATION_PATHS = 10000
+IRRBB_SIMULATION_MODEL = {"a": 0.03, "sigma": 0.01}
+IRRBB_SIMULATION_HORIZON_YEARS = 1.0
+IRRBB_SIMULATION_CONFIDENCE = 0.99
+IRRBB_SIMULATION_QUANTILES = (0.01, 0.05, 0.5, 0.95, 0.99)
+IRRBB_SIMULATION_SEED = 0
+# EVE / NII por bandas temporales de la EBA (flujos agregados y valorados en el punto medio
+# de cada banda) en vez de flujo a flujo. La tabla de gaps por banda se guarda siempre.
+IRRBB_BUCKETED_CASHFLOWS = False
+# Tipos clave de las sensibilidades (PV01 por plazo y producto) que se guardan con cada resultado
+IRRBB_KEY_RATE_TENORS = ("1M", "3M", "6M", "1Y", "2Y", "3Y", "5Y", "10Y")
+# Proyeccion mensual del NII por escenario: horizontes en años (el mas largo fija los meses;
+# vacio para no calcularla) y si el principal que vence se renueva a los tipos del escenario
+IRRBB_NII_PROJECTION_HORIZONS = (1, 3, 5)
+IRRBB_NII_CONSTANT_BALANCE = True
+# Agrupacion de contratos homogeneos en pools antes de valorar (mas rapido, aproximado):
+# meses de vencimiento y pb de tipo por tramo, meses de fecha de inicio por tramo (None =
+# sin separar por inicio), y si se valora tambien la cartera exacta para guardar el error
+# de la agrupacion
+IRRBB_POOLING = False
+IRRBB_POOLING_MATURITY_MONTHS = 1
+IRRBB_POOLING_RATE_BAND_BP = 25
+IRRBB_POOLING_START_MONTHS = None
+IRRBB_POOLING_CHECK = False